@@ -0,0 +1,182 @@
+#!/usr/bin/python
+# Helpers shared by the scripts that read the AFLW face list (frp.txt)
+import os, itertools, zlib
+import numpy as np
+from PIL import Image
+
+def read_frp(path):
+	"""
+	read_frp(Path) -> list of rows
+	Each row is the whitespace-split line: face id, image path,
+	face rect x, y, width, height, then roll, pitch and yaw.
+	"""
+	with open(path) as f:
+		return [l.split() for l in f.readlines()]
+
+def group_rows(lines):
+	"""
+	group_rows(Rows) -> list of (ImagePath, RowIndices)
+	Group consecutive rows that point at the same image, so that each
+	image only has to be decoded once for all of its faces.
+	changefile.py sorts frp.txt by image, so every face of an image
+	ends up in the same group.
+	"""
+	return [(imgpath, list(rows)) for imgpath, rows in
+			itertools.groupby(xrange(len(lines)), key=lambda i: lines[i][1])]
+
+def shard_dirs(nshards):
+	"""
+	shard_dirs(ShardCount) -> list of subdirectories
+	The names are fixed-width hex, so they sort in shard order.
+	With no sharding, the crops go straight into the crop directory.
+	"""
+	if not nshards:
+		return ['']
+	width = len('%x' % (nshards - 1))
+	return ['%0*x/' % (width, n) for n in xrange(nshards)]
+
+def shard_dir(name, nshards):
+	"""
+	shard_dir(CropName, ShardCount) -> subdirectory
+	Pick a crop's shard by hashing its name, so the shards fill up evenly
+	and a crop always lands in the same shard.
+	"""
+	if not nshards:
+		return ''
+	width = len('%x' % (nshards - 1))
+	return '%0*x/' % (width, (zlib.crc32(name) & 0xffffffff) % nshards)
+
+def write_shard_manifests(manifest, nshards):
+	"""
+	write_shard_manifests(ManifestPath, ShardCount) -> list of manifest paths
+	Split a manifest of sharded crops into one manifest per shard, saved
+	under the same name inside the shard's directory next to its crops.
+	"""
+	byshard = {}
+	with open(manifest) as f:
+		for l in f:
+			byshard.setdefault(os.path.dirname(l.split()[0]), []).append(l)
+	paths = []
+	for shard in sorted(byshard):
+		path = os.path.join(shard, os.path.basename(manifest))
+		with open(path, 'w') as f:
+			f.writelines(byshard[shard])
+		paths.append(path)
+	return paths
+
+def box_iou(boxes, gt):
+	"""
+	box_iou(Boxes, GroundTruth) -> ndarray
+	The IoU of every box with every ground truth box, for N x 4 and
+	M x 4 arrays of (x, y, width, height), as an N x M array.
+	"""
+	x1 = np.maximum(boxes[:, np.newaxis, 0], gt[np.newaxis, :, 0])
+	y1 = np.maximum(boxes[:, np.newaxis, 1], gt[np.newaxis, :, 1])
+	x2 = np.minimum((boxes[:, 0] + boxes[:, 2])[:, np.newaxis], (gt[:, 0] + gt[:, 2])[np.newaxis, :])
+	y2 = np.minimum((boxes[:, 1] + boxes[:, 3])[:, np.newaxis], (gt[:, 1] + gt[:, 3])[np.newaxis, :])
+	inter = np.maximum(x2 - x1, 0) * np.maximum(y2 - y1, 0)
+	area = boxes[:, 2] * boxes[:, 3]
+	gtarea = gt[:, 2] * gt[:, 3]
+	return inter / (area[:, np.newaxis] + gtarea[np.newaxis, :] - inter)
+
+def sample_negatives(rng, faces, width, height, k, ncandidates=64, max_iou=0.1):
+	"""
+	sample_negatives(RandomState, Faces, Width, Height, K, CandidateCount, MaxIoU) -> ndarray
+	Propose a batch of boxes inside the image, sized like the faces in it,
+	throw away any that overlap a face by more than MaxIoU, and return
+	up to K of the rest as a K x 4 int array of (x, y, width, height).
+	The boxes that come closest to a face are kept, since those are the
+	hardest for the net to tell apart from one.
+	"""
+	faces = np.asarray(faces, dtype=np.float64).reshape(-1, 4)
+	# each candidate takes its size from a random face, give or take a quarter
+	ref = faces[rng.randint(len(faces), size=ncandidates)]
+	scale = rng.uniform(0.75, 1.25, size=ncandidates)
+	w = np.minimum(ref[:, 2] * scale, width)
+	h = np.minimum(ref[:, 3] * scale, height)
+	x = rng.uniform(size=ncandidates) * (width - w)
+	y = rng.uniform(size=ncandidates) * (height - h)
+	boxes = np.floor(np.column_stack((x, y, w, h)))
+	iou = box_iou(boxes, faces).max(axis=1)
+	ok = np.flatnonzero(iou <= max_iou)
+	keep = ok[np.argsort(-iou[ok], kind='mergesort')[:k]]
+	return boxes[keep].astype(int)
+
+def open_image(path):
+	"""
+	open_image(Path) -> Image
+	Open and fully decode an image, so that cropping it repeatedly
+	doesn't go back to the file.
+	"""
+	img = Image.open(path)
+	img.load()
+	return img
+
+# Label functions take the roll, pitch and yaw of a face (in radians) and
+# return its class, or None if the face should be left out of the dataset.
+# Non-face samples are always class 0.
+
+def face_label(roll, pitch, yaw):
+	return 1
+
+def angle_bin(angle, threshold=0.26):
+	"""
+	angle_bin(Angle, Threshold) -> 1, 2 or 3
+	Below -threshold, within +/-threshold, or above threshold.
+	"""
+	if angle < -threshold:
+		return 1
+	elif -threshold <= angle <= threshold:
+		return 2
+	else:
+		return 3
+
+def pitch_label(roll, pitch, yaw):
+	# only use faces that are fairly upright and facing the camera
+	if abs(yaw) > 0.65 or abs(roll) > 0.65:
+		return None
+	return angle_bin(pitch)
+
+def yaw_label(roll, pitch, yaw):
+	if abs(pitch) > 0.65 or abs(roll) > 0.65:
+		return None
+	return angle_bin(yaw)
+
+def roll_label(roll, pitch, yaw):
+	if abs(yaw) > 0.65 or abs(pitch) > 0.65:
+		return None
+	return angle_bin(roll)
+
+class LabelSet(object):
+	"""
+	LabelSet(Name, LabelFunction, Suffix) -> LabelSet
+
+	One dataset built from frp.txt: its label function, and the names
+	of the crop directories, manifests, LMDB databases and mean files
+	it's written to. The face set keeps the original names (train/,
+	train.txt, train_lmdb), the others follow the pitch set's naming
+	(train-pitch/, train-pitch.txt, train-pitch-lmdb).
+	"""
+	def __init__(self, name, func, suffix=''):
+		self.name = name
+		self.func = func
+		self.suffix = suffix
+	def label(self, roll, pitch, yaw):
+		return self.func(roll, pitch, yaw)
+	def cropdir(self, split):
+		return split + self.suffix
+	def manifest(self, split):
+		return split + self.suffix + '.txt'
+	def lmdb(self, split):
+		if self.suffix:
+			return split + self.suffix + '-lmdb'
+		return split + '_lmdb'
+	def mean(self, split):
+		return 'image_mean_' + split + self.suffix.replace('-', '_') + '.binaryproto'
+
+LABELSETS = {
+	'face': LabelSet('face', face_label),
+	'pitch': LabelSet('pitch', pitch_label, '-pitch'),
+	'yaw': LabelSet('yaw', yaw_label, '-yaw'),
+	'roll': LabelSet('roll', roll_label, '-roll'),
+}
@@ -0,0 +1,275 @@
+#!/usr/bin/python
+# Inference backends: caffe itself, or a NumPy forward pass for the
+# classification nets (AlexNet and the like) on machines without caffe.
+# The NumPy backend reads the layers from the deploy prototxt and the
+# weights from a .npz exported from the caffemodel on a machine with caffe:
+#   ./backend.py deploy.prototxt model.caffemodel model.npz
+# which also holds the mean the images are preprocessed with, so nothing
+# from a caffe checkout is needed to run it.
+import sys, os, re
+import numpy as np
+from numpy.lib.stride_tricks import as_strided
+import preprocess
+
+caffe_path = os.path.expanduser('~/caffe/')
+
+BACKENDS = ('caffe', 'numpy')
+# the layer types NumpyNet can run
+LAYER_TYPES = ('Input', 'Convolution', 'ReLU', 'LRN', 'Pooling', 'InnerProduct', 'Dropout', 'Softmax')
+
+def load_net(deploy, model, backend=None):
+	"""
+	load_net(Deploy, Model, Backend) -> Net
+	Backend is 'caffe' for a .caffemodel or 'numpy' for exported .npz
+	weights, and goes by Model's extension if not given.
+	Either way the net has the parts of caffe.Net the scripts use:
+	blobs[name].data, blobs[name].reshape(*shape) and forward() -> {output: array}
+	"""
+	if backend is None:
+		backend = 'numpy' if model.endswith('.npz') else 'caffe'
+	if backend == 'numpy':
+		return NumpyNet(deploy, model)
+	if backend != 'caffe':
+		raise ValueError('Unknown backend {:s}, expected one of {:s}'.format(backend, ', '.join(BACKENDS)))
+	# only imported when it's needed, since importing it takes a while too
+	import caffe
+	return caffe.Net(deploy, model, caffe.TEST)
+
+def load_mean(model=None):
+	"""
+	load_mean(Model) -> per-channel mean
+	The one saved in Model if it's an exported .npz that has it,
+	otherwise the ImageNet mean from the caffe checkout.
+	"""
+	if model and model.endswith('.npz'):
+		npz = np.load(model)
+		if 'mean' in npz.files:
+			return npz['mean']
+	return np.load(caffe_path+'python/caffe/imagenet/ilsvrc_2012_mean.npy').mean(1).mean(1)
+
+def load_model(deploy, model):
+	"""
+	load_model(Deploy, Model) -> (Net, BatchTransformer)
+	Model can be a .caffemodel, or .npz weights for the NumPy backend.
+	"""
+	net = load_net(deploy, model)
+	return net, preprocess.BatchTransformer(net.blobs['data'].data.shape, load_mean(model))
+
+def export_weights(deploy, model, npzpath):
+	"""
+	export_weights(Deploy, Caffemodel, NpzPath) -> None
+	Save every layer's parameter blobs as "layer/0", "layer/1" and so on,
+	and the per-channel mean as "mean".
+	"""
+	import caffe
+	net = caffe.Net(deploy, model, caffe.TEST)
+	arrays = dict((name+'/'+str(i), blob.data) for name, blobs in net.params.items()
+		for i, blob in enumerate(blobs))
+	arrays['mean'] = load_mean()
+	np.savez(npzpath, **arrays)
+
+def parse_prototxt(text):
+	"""
+	parse_prototxt(Text) -> dict of field name -> list of values
+	Reads protobuf text format without the schema. Nested messages
+	are dicts like the top one, and every field is a list since
+	any of them can repeat.
+	"""
+	tokens = re.findall(r'"[^"]*"|[{}:]|[^\s{}:"#]+', re.sub(r'#[^\n]*', '', text))
+	def scalar(token):
+		if token[0] == '"':
+			return token[1:-1]
+		for parse in (int, float):
+			try:
+				return parse(token)
+			except ValueError:
+				pass
+		# enum values and booleans stay as strings
+		return token
+	def message(i):
+		msg = {}
+		while i < len(tokens) and tokens[i] != '}':
+			name = tokens[i]
+			i += 1
+			if tokens[i] == ':':
+				i += 1
+			if tokens[i] == '{':
+				value, i = message(i+1)
+			else:
+				value = scalar(tokens[i])
+			msg.setdefault(name, []).append(value)
+			i += 1
+		return msg, i
+	return message(0)[0]
+
+def field(msg, name, default=None):
+	"""
+	field(Message, Name, Default) -> first value of the field, or Default
+	"""
+	return msg.get(name, [default])[0]
+
+def conv_forward(x, weights, bias, stride, pad, group):
+	"""
+	conv_forward(Input, Weights, Bias, Stride, Pad, Group) -> output
+	Lay the input windows out with strides (like caffe's im2col)
+	and multiply them by each group's filters in one tensordot.
+	"""
+	if pad:
+		x = np.pad(x, ((0, 0), (0, 0), (pad, pad), (pad, pad)), 'constant')
+	n, c, h, w = x.shape
+	o, cg, kh, kw = weights.shape
+	oh, ow = (h - kh) // stride + 1, (w - kw) // stride + 1
+	s = x.strides
+	cols = as_strided(x, (n, c, kh, kw, oh, ow), s + (s[2]*stride, s[3]*stride))
+	out = np.empty((n, o, oh, ow), dtype=np.float32)
+	og = o // group
+	for g in xrange(group):
+		out[:, g*og:(g+1)*og] = np.tensordot(weights[g*og:(g+1)*og], cols[:, g*cg:(g+1)*cg],
+			axes=([1, 2, 3], [1, 2, 3])).transpose(1, 0, 2, 3)
+	if bias is not None:
+		out += bias[np.newaxis, :, np.newaxis, np.newaxis]
+	return out
+
+def pool_forward(x, kernel, stride, pad):
+	"""
+	pool_forward(Input, Kernel, Stride, Pad) -> output
+	Max pooling, with caffe's output size: rounded up, so the last
+	window can hang off the edge, except where it would start in the padding.
+	"""
+	n, c, h, w = x.shape
+	def outsize(size):
+		out = -(-(size + 2*pad - kernel) // stride) + 1
+		if pad and (out - 1) * stride >= size + pad:
+			out -= 1
+		return out
+	oh, ow = outsize(h), outsize(w)
+	padded = np.empty((n, c, (oh-1)*stride + kernel, (ow-1)*stride + kernel), dtype=np.float32)
+	padded[...] = -np.inf
+	ph, pw = min(h, padded.shape[2] - pad), min(w, padded.shape[3] - pad)
+	padded[:, :, pad:pad+ph, pad:pad+pw] = x[:, :, :ph, :pw]
+	s = padded.strides
+	windows = as_strided(padded, (n, c, oh, ow, kernel, kernel), s[:2] + (s[2]*stride, s[3]*stride) + s[2:])
+	return windows.max(axis=(4, 5))
+
+def lrn_forward(x, size, alpha, beta, k):
+	"""
+	lrn_forward(Input, LocalSize, Alpha, Beta, K) -> output
+	Normalisation across channels, summing the squares of a window
+	of LocalSize channels by adding up shifted slices.
+	"""
+	n, c, h, w = x.shape
+	pre = (size - 1) // 2
+	squares = np.zeros((n, c + size - 1, h, w), dtype=np.float32)
+	np.square(x, out=squares[:, pre:pre+c])
+	scale = squares[:, :c].copy()
+	for i in xrange(1, size):
+		scale += squares[:, i:i+c]
+	scale *= alpha / size
+	scale += k
+	return x * scale ** -beta
+
+def softmax_forward(x):
+	"""
+	softmax_forward(Input) -> output
+	Softmax over the channels.
+	"""
+	e = np.exp(x - x.max(axis=1, keepdims=True))
+	return e / e.sum(axis=1, keepdims=True)
+
+class Blob(object):
+	"""
+	Blob(Shape) -> Blob
+	"""
+	def __init__(self, shape):
+		self.data = np.zeros(shape, dtype=np.float32)
+
+	def reshape(self, *shape):
+		if tuple(shape) != self.data.shape:
+			self.data = np.zeros(shape, dtype=np.float32)
+
+class NumpyNet(object):
+	"""
+	NumpyNet(Deploy, NpzPath) -> NumpyNet
+
+	Runs the test-phase forward pass of a deploy prototxt in NumPy.
+	Supports the layers the classification nets use: Input, Convolution
+	(with pad, stride and group), ReLU, LRN (across channels), Pooling (MAX),
+	InnerProduct, Dropout and Softmax. Anything else raises a ValueError.
+	"""
+	def __init__(self, deploy, weights):
+		with open(deploy) as f:
+			self.layers = parse_prototxt(f.read()).get('layer', [])
+		self.blobs = {}
+		available = []
+		for layer in self.layers:
+			kind = field(layer, 'type')
+			if kind not in LAYER_TYPES:
+				raise ValueError('{:s} layer {:s} is not supported by the NumPy backend'.format(kind, field(layer, 'name')))
+			if kind == 'Input':
+				shape = field(field(layer, 'input_param'), 'shape')
+				self.blobs[field(layer, 'top')] = Blob(shape['dim'])
+			for bottom in layer.get('bottom', []):
+				if bottom in available:
+					available.remove(bottom)
+			for top in layer.get('top', []):
+				self.blobs.setdefault(top, Blob(()))
+				available.append(top)
+		# like caffe, the outputs are the blobs nothing else uses
+		self.outputs = available
+		params = np.load(weights)
+		self.params = {}
+		for key in params.files:
+			# the mean is for preprocessing, not a layer's
+			if '/' not in key:
+				continue
+			name, i = key.rsplit('/', 1)
+			self.params.setdefault(name, {})[int(i)] = params[key].astype(np.float32)
+
+	def forward_layer(self, layer):
+		"""
+		forward_layer(Layer) -> output array
+		"""
+		kind = field(layer, 'type')
+		name = field(layer, 'name')
+		x = self.blobs[field(layer, 'bottom')].data if 'bottom' in layer else None
+		params = self.params.get(name, {})
+		if kind == 'Convolution':
+			p = field(layer, 'convolution_param')
+			return conv_forward(x, params[0], params.get(1), field(p, 'stride', 1),
+				field(p, 'pad', 0), field(p, 'group', 1))
+		if kind == 'InnerProduct':
+			out = x.reshape(x.shape[0], -1).dot(params[0].T)
+			if 1 in params:
+				out += params[1]
+			return out
+		if kind == 'ReLU':
+			return np.maximum(x, 0)
+		if kind == 'LRN':
+			p = field(layer, 'lrn_param', {})
+			if field(p, 'norm_region', 'ACROSS_CHANNELS') != 'ACROSS_CHANNELS':
+				raise ValueError('LRN layer {:s}: only ACROSS_CHANNELS is supported'.format(name))
+			return lrn_forward(x, field(p, 'local_size', 5), field(p, 'alpha', 1.0),
+				field(p, 'beta', 0.75), field(p, 'k', 1.0))
+		if kind == 'Pooling':
+			p = field(layer, 'pooling_param')
+			if field(p, 'pool', 'MAX') != 'MAX':
+				raise ValueError('Pooling layer {:s}: only MAX pooling is supported'.format(name))
+			return pool_forward(x, field(p, 'kernel_size'), field(p, 'stride', 1), field(p, 'pad', 0))
+		if kind == 'Softmax':
+			return softmax_forward(x)
+		# Dropout does nothing at test time
+		return x
+
+	def forward(self):
+		"""
+		forward() -> dict of output blob name -> array
+		"""
+		for layer in self.layers:
+			if field(layer, 'type') != 'Input':
+				self.blobs[field(layer, 'top')].data = self.forward_layer(layer)
+		return dict((name, self.blobs[name].data) for name in self.outputs)
+
+if __name__ == '__main__':
+	if len(sys.argv) != 4:
+		sys.exit('Usage: {:s} deploy.prototxt model.caffemodel model.npz'.format(sys.argv[0]))
+	export_weights(*sys.argv[1:])
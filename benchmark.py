@@ -0,0 +1,162 @@
+#!/usr/bin/python
+# Measures inference latency and throughput of the classifiers over a
+# sweep of batch sizes and thread counts, e.g.
+#   ./benchmark.py --model deploy.prototxt caffe_train_iter_50000.caffemodel \
+#                  --model deploy-pitch.prototxt models/train_pitch_iter_50000.npz \
+#                  --batch-sizes 1,10,32 --threads 1,4 --output results.json
+# and compares two saved runs for regressions:
+#   ./benchmark.py --compare before.json after.json
+# Each configuration runs in its own process, so the BLAS thread count
+# takes effect and the peak memory use is that configuration's alone.
+import sys, os, time, json, platform, subprocess, resource, argparse
+import numpy as np
+
+model_dir = os.path.expanduser('~/caffe-model-project/')
+# the thread count is read by whichever BLAS numpy or caffe was built with
+THREAD_VARS = ('OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS')
+
+def percentiles(times):
+	"""
+	percentiles(list of seconds) -> dict of latency statistics in ms
+	"""
+	ms = np.array(times) * 1000
+	return {'mean': float(ms.mean()), 'p50': float(np.percentile(ms, 50)),
+		'p95': float(np.percentile(ms, 95)), 'p99': float(np.percentile(ms, 99))}
+
+def run_config(config):
+	"""
+	run_config(Config) -> result dict
+	Time Config['iterations'] batches after a few untimed warmup ones.
+	This runs in the child process, with the thread variables already set.
+	Synthetic batches are random 227x227 images, which are preprocessed
+	and run through the net; real ones are also loaded from disk each time.
+	"""
+	# only the child processes load nets
+	import backend, preprocess
+	net, transformer = backend.load_model(config['deploy'], config['weights'])
+	batch_size = config['batch_size']
+	shape = net.blobs['data'].data.shape[1:]
+	net.blobs['data'].reshape(batch_size, *shape)
+	data = net.blobs['data'].data
+	if config['input'] == 'synthetic':
+		rng = np.random.RandomState(0)
+		synthetic = rng.randint(0, 256, (batch_size,) + shape[1:] + (3,)).astype(np.uint8)
+	else:
+		images = [path for path, label in preprocess.list_images(config['input'])]
+	times = []
+	for it in xrange(config['warmup'] + config['iterations']):
+		start = time.time()
+		if config['input'] == 'synthetic':
+			transformer.preprocess(synthetic, data)
+		else:
+			for n in xrange(batch_size):
+				path = images[(it * batch_size + n) % len(images)]
+				transformer.preprocess(preprocess.load_image(path)[np.newaxis], data[n:n+1])
+		net.forward()
+		if it >= config['warmup']:
+			times.append(time.time() - start)
+	result = dict(config)
+	result['latency_ms'] = percentiles(times)
+	result['images_per_s'] = batch_size * len(times) / sum(times)
+	# kilobytes on Linux
+	result['peak_rss_mb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+	return result
+
+def spawn(config):
+	"""
+	spawn(Config) -> result dict
+	Run one configuration in a fresh process with its thread count.
+	"""
+	env = dict(os.environ)
+	for var in THREAD_VARS:
+		env[var] = str(config['threads'])
+	out = subprocess.check_output([sys.executable, os.path.abspath(__file__),
+		'--run-config', json.dumps(config)], env=env)
+	return json.loads(out.splitlines()[-1])
+
+def key(result):
+	"""
+	key(Result) -> what identifies a configuration between runs
+	"""
+	return (os.path.basename(result['deploy']), os.path.basename(result['weights']),
+		result['input'], result['batch_size'], result['threads'])
+
+def compare(before, after, tolerance):
+	"""
+	compare(BeforePath, AfterPath, Tolerance) -> number of regressions
+	A regression is throughput or p95 latency getting worse by more
+	than Tolerance (a fraction) in a configuration both runs have.
+	"""
+	with open(before) as f:
+		old = dict((key(r), r) for r in json.load(f)['results'])
+	with open(after) as f:
+		new = json.load(f)['results']
+	regressions = 0
+	print '{:<40s} {:>5s} {:>7s} {:>10s} {:>10s} {:>8s} {:>10s} {:>10s} {:>8s}'.format(
+		'model', 'batch', 'threads', 'img/s was', 'img/s now', 'change', 'p95 was', 'p95 now', 'change')
+	for r in new:
+		o = old.get(key(r))
+		if o is None:
+			continue
+		speed = r['images_per_s'] / o['images_per_s'] - 1
+		latency = r['latency_ms']['p95'] / o['latency_ms']['p95'] - 1
+		flag = ''
+		if speed < -tolerance or latency > tolerance:
+			regressions += 1
+			flag = '  REGRESSION'
+		print '{:<40s} {:>5d} {:>7d} {:>10.1f} {:>10.1f} {:>+7.1%} {:>10.2f} {:>10.2f} {:>+7.1%}{:s}'.format(
+			os.path.basename(r['weights']) + ' ' + os.path.basename(r['input']), r['batch_size'], r['threads'],
+			o['images_per_s'], r['images_per_s'], speed, o['latency_ms']['p95'], r['latency_ms']['p95'], latency, flag)
+	return regressions
+
+def parse_args():
+	"""Parse input arguments."""
+	parser = argparse.ArgumentParser(description='Benchmark the classifiers')
+	parser.add_argument('--model', nargs=2, action='append', default=[], metavar=('DEPLOY', 'WEIGHTS'),
+						help='Model to benchmark, a caffemodel or exported .npz, relative to '+model_dir+' (repeatable)')
+	parser.add_argument('--input', action='append', default=[],
+						help='"synthetic", or a directory or manifest of real images (repeatable) [synthetic]')
+	parser.add_argument('--batch-sizes', dest='batch_sizes', default='1,10',
+						help='Comma-separated batch sizes [1,10]')
+	parser.add_argument('--threads', default='1',
+						help='Comma-separated BLAS/OpenMP thread counts [1]')
+	parser.add_argument('--iterations', default=50, type=int, help='Timed batches per configuration [50]')
+	parser.add_argument('--warmup', default=5, type=int, help='Untimed batches first [5]')
+	parser.add_argument('--output', help='JSON file to save the results to')
+	parser.add_argument('--compare', nargs=2, metavar=('BEFORE', 'AFTER'),
+						help='Compare two saved results instead, exiting with 1 on a regression')
+	parser.add_argument('--tolerance', default=10, type=float,
+						help='Percent change allowed before --compare calls it a regression [10]')
+	parser.add_argument('--run-config', dest='run_config', help=argparse.SUPPRESS)
+	return parser.parse_args()
+
+if __name__ == '__main__':
+	args = parse_args()
+	if args.run_config:
+		print json.dumps(run_config(json.loads(args.run_config)))
+		sys.exit()
+	if args.compare:
+		sys.exit(1 if compare(args.compare[0], args.compare[1], args.tolerance / 100.0) else 0)
+	if not args.model:
+		sys.exit('Nothing to benchmark, give at least one --model')
+
+	inputs = [i if i == 'synthetic' else os.path.abspath(os.path.expanduser(i)) for i in args.input or ['synthetic']]
+	results = []
+	for deploy, weights in args.model:
+		for inp in inputs:
+			for threads in [int(t) for t in args.threads.split(',')]:
+				for batch_size in [int(b) for b in args.batch_sizes.split(',')]:
+					config = {'deploy': os.path.join(model_dir, os.path.expanduser(deploy)),
+						'weights': os.path.join(model_dir, os.path.expanduser(weights)),
+						'backend': 'numpy' if weights.endswith('.npz') else 'caffe',
+						'input': inp, 'batch_size': batch_size, 'threads': threads,
+						'iterations': args.iterations, 'warmup': args.warmup}
+					r = spawn(config)
+					results.append(r)
+					print '{:s} {:s} batch {:d}, {:d} threads: {:.1f} images/s, p50/p95/p99 {:.2f}/{:.2f}/{:.2f} ms, peak RSS {:.0f} MB'.format(
+						os.path.basename(weights), os.path.basename(inp), batch_size, threads, r['images_per_s'],
+						r['latency_ms']['p50'], r['latency_ms']['p95'], r['latency_ms']['p99'], r['peak_rss_mb'])
+	if args.output:
+		with open(args.output, 'w') as f:
+			json.dump({'host': platform.node(), 'machine': platform.machine(), 'cpus': os.sysconf('SC_NPROCESSORS_ONLN'),
+				'time': time.strftime('%Y-%m-%d %H:%M:%S'), 'results': results}, f, indent=1, sort_keys=True)
@@ -3,16 +3,80 @@
 # 2016-07-12
 
 # Sorts the list of images and their values by the image filename
-import re
+# Files bigger than the memory budget are sorted in chunks,
+# which are then merged from temporary files
+import re, os, heapq, tempfile, argparse
+import numpy as np
+
+nondigits = re.compile(r"[^0-9]+")
 
 def num(x):
-	return int(re.sub(r"[^0-9]+", '', x))
-
-f=open('frp-original.txt')
-n=open('frp.txt','w')
-lines=f.readlines()
-f.close()
-lines.sort(key=lambda x: num(x.split()[1]))
-for l in lines:
-	n.write(l)
-n.close()
+	return int(nondigits.sub('', x))
+
+def sort_lines(lines):
+	"""
+	sort_lines(Lines) -> (keys, order)
+	Parse every line's key just once into a compact array, and the
+	indices of the lines sorted by it (stably, like list.sort).
+	"""
+	keys = np.fromiter((num(l.split()[1]) for l in lines), dtype=np.int64, count=len(lines))
+	return keys, np.argsort(keys, kind='mergesort')
+
+def write_chunk(lines, keys, order):
+	"""
+	write_chunk(Lines, Keys, Order) -> file
+	Save a chunk, sorted as sort_lines gives it, to a temporary file with
+	its keys in front, so the merge doesn't have to parse them again.
+	"""
+	tmp = tempfile.TemporaryFile()
+	for i in order:
+		key, l = keys[i], lines[i]
+		if not l.endswith('\n'):
+			l += '\n'
+		tmp.write(str(key) + ' ' + l)
+	tmp.seek(0)
+	return tmp
+
+def read_chunk(tmp, n):
+	"""
+	read_chunk(File, ChunkNumber) -> iterator of (Key, ChunkNumber, Line)
+	The chunk number keeps equal keys in their original order during the merge.
+	"""
+	for l in tmp:
+		key, l = l.split(' ', 1)
+		yield (int(key), n, l)
+
+def parse_args():
+	"""Parse input arguments."""
+	parser = argparse.ArgumentParser(description='Sort frp.txt by image filename')
+	parser.add_argument('input', nargs='?', default='frp-original.txt')
+	parser.add_argument('output', nargs='?', default='frp.txt')
+	parser.add_argument('--memory', default=256, type=int,
+						help='Memory budget in MB, bigger files are sorted externally [256]')
+	return parser.parse_args()
+
+if __name__ == '__main__':
+	args = parse_args()
+	budget = args.memory << 20
+	f=open(args.input)
+	n=open(args.output,'w')
+	# the lines in memory take a few times the size of their text, so leave some room
+	chunk_size = max(budget / 4, 1)
+	if os.path.getsize(args.input) <= chunk_size:
+		lines=f.readlines()
+		keys, order = sort_lines(lines)
+		for i in order:
+			n.write(lines[i])
+	else:
+		chunks = []
+		while True:
+			lines = f.readlines(chunk_size)
+			if not lines:
+				break
+			chunks.append(write_chunk(lines, *sort_lines(lines)))
+		for key, c, l in heapq.merge(*[read_chunk(tmp, c) for c, tmp in enumerate(chunks)]):
+			n.write(l)
+		for tmp in chunks:
+			tmp.close()
+	f.close()
+	n.close()
@@ -1,63 +1,154 @@
 #!/usr/bin/python
 # 2016-07-12
 
-import sys, os
+import sys, os, time, json, csv, argparse
 import numpy as np
-import caffe
+import prefetch, preprocess, backend, modelserver, predcache
 
-caffe_path = os.path.expanduser('~/caffe/')
 model_dir = os.path.expanduser('~/caffe-model-project/')
-deploy = sys.argv[1]
+
+def classify_batches(net, transformer, images, batch_size, workers):
+	"""
+	classify_batches(Net, Transformer, Images, BatchSize, Workers) -> iterator of (Images, Probabilities)
+	Fill the data blob a batch at a time and run one forward pass per batch.
+	The images of the next batches are loaded and preprocessed on
+	background threads while the net works through the current one.
+	The last batch is padded out with whatever was in the blob before.
+	"""
+	def load(image, out):
+		transformer.preprocess(preprocess.load_image(image[0])[np.newaxis], out[np.newaxis])
+	batches = prefetch.BatchPrefetcher(images, load, batch_size, net.blobs['data'].data.shape[1:], workers)
+	for batch, buf in batches:
+		net.blobs['data'].data[...] = buf
+		out = net.forward()
+		yield batch, out['prob'][:len(batch)]
+
+def classify_remote(client, deploy, model, images, batch_size):
+	"""
+	classify_remote(Client, Deploy, Model, Images, BatchSize) -> iterator of (Images, Probabilities)
+	The same, but asking a running model server, a batch per request.
+	"""
+	for b in xrange(0, len(images), batch_size):
+		batch = images[b:b+batch_size]
+		yield batch, client.classify(deploy, model, [image[0] for image in batch])
+
+def parse_args():
+	"""Parse input arguments."""
+	parser = argparse.ArgumentParser(description='Classify images with a trained model')
+	parser.add_argument('deploy', help='Deploy prototxt, relative to '+model_dir)
+	parser.add_argument('model', help='Trained caffemodel, or weights exported to .npz '
+						'to run without caffe, relative to '+model_dir)
+	parser.add_argument('image', nargs='?', help='Image to classify, prompted for if not given')
+	parser.add_argument('-r', '--repeat', action='store_true',
+						help='Keep prompting for images to classify')
+	parser.add_argument('--input', help='Directory or train.txt/val.txt-style manifest '
+						'of images to classify in batches')
+	parser.add_argument('--batch-size', dest='batch_size', default=10, type=int,
+						help='Images per forward pass with --input [10]')
+	parser.add_argument('--workers', default=4, type=int,
+						help='Threads loading and preprocessing images with --input [4]')
+	parser.add_argument('--output', help='File to write --input predictions to, '
+						'as JSON lines if it ends in .jsonl, otherwise CSV')
+	parser.add_argument('--server', default=modelserver.SOCKET_PATH,
+						help='Model server socket to use if one is running ['+modelserver.SOCKET_PATH+']')
+	parser.add_argument('--local', action='store_true',
+						help="Load the model here even if there's a model server running")
+	parser.add_argument('--cache', default=predcache.CACHE_PATH,
+						help='Prediction cache, keyed by image and model contents ['+predcache.CACHE_PATH+']')
+	parser.add_argument('--cache-size', dest='cache_size', default=500000, type=int,
+						help='Most predictions to keep in the cache, least recently used go first [500000]')
+	parser.add_argument('--no-cache', dest='no_cache', action='store_true',
+						help="Don't use the prediction cache")
+	return parser.parse_args()
+
+args = parse_args()
+deploy = args.deploy
 if deploy[0] != '/':
 	deploy = model_dir + deploy
-model_name = sys.argv[2]
+model_name = args.model
 if model_name[0] != '/':
 	model_name = model_dir + model_name
 
-repeat=False
-image_path_set=False
-if len(sys.argv) > 3:
-	if sys.argv[3] in ('-r', '--repeat'):
-		repeat=True
-	else:
-		image_path_set=True
-		image_path = sys.argv[3]
-		image_path = os.path.expanduser(image_path)
+repeat=args.repeat
+image_path_set=args.image is not None
+if image_path_set:
+	image_path = os.path.expanduser(args.image)
 
 
-#load the model
-net = caffe.Net(deploy,
-                model_name,
-                caffe.TEST)
+#use the model server if there's one running, otherwise the model is loaded
+#here, but only once there's something the prediction cache doesn't have
+client = None if args.local else modelserver.connect(args.server)
+net = None
+cache = None if args.no_cache else predcache.PredictionCache(args.cache, deploy, model_name, args.cache_size)
 
-# load input and configure preprocessing
-transformer = caffe.io.Transformer({'data': net.blobs['data'].data.shape})
-transformer.set_mean('data', np.load(caffe_path+'python/caffe/imagenet/ilsvrc_2012_mean.npy').mean(1).mean(1))
-transformer.set_transpose('data', (2,0,1))
-transformer.set_channel_swap('data', (2,1,0))
-transformer.set_raw_scale('data', 255.0)
+def classify(images, batch_size):
+	"""
+	classify(Images, BatchSize) -> iterator of (Images, Probabilities)
+	Ask the model server, or load the model and configure
+	preprocessing the first time and run it here.
+	"""
+	global net, transformer
+	if client:
+		return classify_remote(client, deploy, model_name, images, batch_size)
+	if net is None:
+		net, transformer = backend.load_model(deploy, model_name)
+	#note we can change the batch size on-the-fly
+	net.blobs['data'].reshape(batch_size,3,227,227)
+	return classify_batches(net, transformer, images, batch_size, args.workers)
 
-#note we can change the batch size on-the-fly
-#since we classify only one image, we change batch size from 10 to 1
-net.blobs['data'].reshape(1,3,227,227)
+def classify_cached(images, batch_size):
+	"""
+	classify_cached(Images, BatchSize) -> iterator of (Images, Probabilities)
+	Only classify the images the prediction cache doesn't have.
+	"""
+	if cache is None:
+		return classify(images, batch_size)
+	return predcache.cached_batches(cache, lambda misses: classify(misses, batch_size), images, batch_size)
+
+if args.input:
+	# score a whole directory or manifest, a batch per forward pass
+	images = preprocess.list_images(os.path.expanduser(args.input))
+	batches = classify_cached(images, args.batch_size)
+	out_file = open(args.output, 'w') if args.output else None
+	jsonl = args.output and args.output.endswith('.jsonl')
+	writer = None
+	done, correct, labelled = 0, 0, 0
+	start = time.time()
+	for batch, probs in batches:
+		if out_file and not jsonl and writer is None:
+			writer = csv.writer(out_file)
+			writer.writerow(['path', 'label', 'prediction'] + ['prob'+str(c) for c in xrange(probs.shape[1])])
+		for (image_path, label), prob in zip(batch, probs):
+			prediction = int(prob.argmax())
+			if label is not None:
+				labelled += 1
+				correct += prediction == label
+			if jsonl:
+				out_file.write(json.dumps({'path': image_path, 'label': label,
+					'prediction': prediction, 'prob': prob.tolist()})+'\n')
+			elif out_file:
+				writer.writerow([image_path, label, prediction] + ['%g' % p for p in prob])
+		done += len(batch)
+		te = time.time() - start
+		sys.stdout.write('\r{:d} / {:d} images, {:.1f} images/s'.format(done, len(images), done / te))
+		sys.stdout.flush()
+	sys.stdout.write('\n')
+	if labelled:
+		print 'Accuracy: {:.4f} ({:d} / {:d})'.format(float(correct) / labelled, correct, labelled)
+	if out_file:
+		out_file.close()
+	sys.exit()
 
 while True:
 	if not image_path_set:
 		image_path = raw_input('Enter image path: ').replace("'", "").strip()
 		image_path = os.path.expanduser(image_path)
 
-	#load the image in the data layer
-	im = caffe.io.load_image(image_path)
-	net.blobs['data'].data[...] = transformer.preprocess('data', im)
-
-	#compute
-	out = net.forward()
-
-	# other possibility : out = net.forward_all(data=np.asarray([transformer.preprocess('data', im)]))
-
-	#predicted predicted class
-	print(out['prob'][0])
-	print out['prob'].argmax()
+	#since we classify only one image, the batch size is 1
+	for batch, probs in classify_cached([(image_path, None)], 1):
+		#predicted predicted class
+		print(probs[0])
+		print probs.argmax()
 
 	#print predicted labels
 	#labels = np.loadtxt(caffe_path+"data/ilsvrc12/synset_words.txt", str, delimiter='\t')
@@ -65,4 +156,3 @@ while True:
 	#print labels[top_k]
 	if image_path_set or not repeat:
 		break
-
@@ -0,0 +1,192 @@
+#!/usr/bin/python
+# Streams face crops straight into the LMDB databases that caffe trains from,
+# computing the image mean on the way, instead of going through JPEG files
+# and a separate convert_imageset/compute_image_mean step
+# Run on its own, it converts existing crop manifests, reading shards in parallel
+import os, shutil, hashlib, argparse
+from multiprocessing import Pool
+import numpy as np
+from PIL import Image
+import lmdb
+import caffe
+from caffe.proto import caffe_pb2
+
+def to_caffe_array(img, size):
+	"""
+	to_caffe_array(Image, (Width, Height)) -> ndarray
+	Resize a crop and convert it to the C x H x W, BGR, uint8 layout
+	that convert_imageset stores in its datums.
+	"""
+	arr = np.asarray(img.convert('RGB').resize(size, Image.BILINEAR), dtype=np.uint8)
+	return np.ascontiguousarray(arr[:, :, ::-1].transpose(2, 0, 1))
+
+def datum_to_array(value):
+	"""
+	datum_to_array(SerializedDatum) -> ndarray
+	"""
+	datum = caffe_pb2.Datum()
+	datum.ParseFromString(value)
+	return caffe.io.datum_to_array(datum)
+
+class CropLMDB(object):
+	"""
+	CropLMDB(DatabasePath, MeanPath, Size, TransactionSize, ResumeCount, Seed) -> CropLMDB
+
+	Writes datums into an LMDB database in large write transactions,
+	and keeps a running sum of every image so that the mean can be
+	saved as a binaryproto when the database is closed.
+	A TransactionSize of 0 leaves all commits to the caller.
+
+	caffe's Data layer reads a database in key order and never shuffles,
+	so like convert_imageset --shuffle, the entries are shuffled: each key
+	starts with a hash of Seed and the crop's name, which puts them in an
+	order that looks random but is the same every time for the same Seed.
+
+	Any existing database at DatabasePath is replaced, unless ResumeCount
+	is given, in which case the database is kept and rolled back to its
+	first ResumeCount entries, along with the running sum.
+	"""
+	def __init__(self, dbpath, meanpath, size=(227, 227), txnsize=1000, resume=None, seed=0):
+		if resume is None and os.path.isdir(dbpath):
+			shutil.rmtree(dbpath)
+		self.sumpath = os.path.join(dbpath, 'mean_sum.npz')
+		self.meanpath = meanpath
+		self.size = size
+		self.txnsize = txnsize
+		self.seed = seed
+		# the map only reserves address space, so make it big enough for all of AFLW
+		self.env = lmdb.open(dbpath, map_size=1 << 40)
+		self.txn = self.env.begin(write=True)
+		self.pending = 0
+		self.count = 0
+		self.sum = np.zeros((3, size[1], size[0]), dtype=np.int64)
+		if resume is not None:
+			self.rollback(resume)
+
+	def rollback(self, count):
+		"""
+		rollback(Count) -> None
+		Drop every entry added after the first Count, and bring the running
+		sum (as saved by the last commit) in line with the entries that are
+		left. The shuffled keys are all gone through, but only the entries
+		between the saved sum and Count have their values read.
+		"""
+		saved = 0
+		if os.path.isfile(self.sumpath):
+			npz = np.load(self.sumpath)
+			self.sum, saved = npz['sum'], int(npz['count'])
+		cursor = self.txn.cursor()
+		cursor.first()
+		while cursor.key():
+			index = self.index(cursor.key())
+			if index < count:
+				# committed, but not yet part of the saved sum
+				if index >= saved:
+					self.sum += datum_to_array(cursor.value())
+				cursor.next()
+			else:
+				if index < saved:
+					self.sum -= datum_to_array(cursor.value())
+				cursor.delete()
+		self.count = count
+		self.commit()
+
+	def key(self, name):
+		"""
+		key(Name) -> the key for the next entry
+		The shuffling hash, then the insertion index (for rollback) and Name.
+		"""
+		shuffle = hashlib.sha1('{:d} {:s}'.format(self.seed, name)).hexdigest()[:8]
+		return '{:s}_{:08d}_{:s}'.format(shuffle, self.count, name)
+
+	@staticmethod
+	def index(key):
+		"""
+		index(Key) -> the insertion index in a key from key()
+		"""
+		return int(key[9:17])
+
+	def put(self, name, arr, label):
+		"""
+		put(Name, Array, Label) -> None
+		Add an array from to_caffe_array to the database.
+		"""
+		datum = caffe.io.array_to_datum(arr, label)
+		self.txn.put(self.key(name), datum.SerializeToString())
+		self.sum += arr
+		self.count += 1
+		self.pending += 1
+		if self.txnsize and self.pending >= self.txnsize:
+			self.commit()
+
+	def commit(self):
+		"""
+		commit() -> None
+		Commit the current write transaction and start a new one.
+		The running sum is saved alongside so a resumed build can pick it up.
+		"""
+		self.txn.commit()
+		self.txn = self.env.begin(write=True)
+		self.pending = 0
+		# np.savez insists on the .npz extension
+		tmppath = self.sumpath[:-4] + '.tmp.npz'
+		np.savez(tmppath, sum=self.sum, count=self.count)
+		os.rename(tmppath, self.sumpath)
+
+	def close(self):
+		"""
+		close() -> None
+		Commit what's left, close the database and write the mean binaryproto.
+		"""
+		self.commit()
+		self.txn.abort()
+		self.env.close()
+		if self.count:
+			mean = self.sum.astype(np.float64) / self.count
+			blob = caffe.io.array_to_blobproto(mean[np.newaxis])
+			with open(self.meanpath, 'wb') as f:
+				f.write(blob.SerializeToString())
+
+def load_shard(args):
+	"""
+	load_shard((ManifestPath, (Width, Height))) -> list of (Name, Array, Label)
+	Decode and resize every crop listed in one manifest.
+	"""
+	manifest, size = args
+	crops = []
+	with open(manifest) as f:
+		for l in f:
+			if not l.strip():
+				continue
+			path, label = l.rsplit(None, 1)
+			crops.append((os.path.basename(path), to_caffe_array(Image.open(path), size), int(label)))
+	return crops
+
+def parse_args():
+	"""Parse input arguments."""
+	parser = argparse.ArgumentParser(description='Convert crop manifests into an LMDB database')
+	parser.add_argument('db', help='LMDB database to create')
+	parser.add_argument('mean', help='Mean binaryproto to write')
+	parser.add_argument('manifests', nargs='+',
+						help='Manifests to convert, e.g. every per-shard manifest of a crop directory')
+	parser.add_argument('--workers', default=4, type=int,
+						help='Number of manifests to decode in parallel [4]')
+	parser.add_argument('--size', default=227, type=int,
+						help='Width and height to resize crops to [227]')
+	parser.add_argument('--seed', default=0, type=int,
+						help='Seed for the order the entries are shuffled into [0]')
+	return parser.parse_args()
+
+if __name__ == '__main__':
+	args = parse_args()
+	size = (args.size, args.size)
+	db = CropLMDB(args.db, args.mean, size, seed=args.seed)
+	# the workers decode whole shards, the entries are still numbered in manifest order
+	pool = Pool(args.workers)
+	for manifest, crops in zip(args.manifests, pool.imap(load_shard, [(m, size) for m in args.manifests])):
+		for name, arr, label in crops:
+			db.put(name, arr, label)
+		print '{:s}: {:d} crops ({:d} total)'.format(manifest, len(crops), db.count)
+	pool.close()
+	pool.join()
+	db.close()
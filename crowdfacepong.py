@@ -3,7 +3,7 @@
 # 2016-07-28
 # Crowdface pong: 2-side pong game controlled by a crowd of people changing the angle of their heads
 
-import sys, os, math, time, random, pygame
+import sys, os, math, time, random, argparse, pygame
 
 class Team(object):
 	"""
@@ -72,8 +72,8 @@ class Paddle(object):
 	def __init__(self, game, team, pos, size, moverate, col):
 		self.team = team
 
-		# The dir property is currently ternary (of values -1, 0, or 1)
-		# This will be replaced once crowdface pose estimation has been integrated
+		# The dir property is ternary (of values -1, 0, or 1)
+		# It's set from the crowd pose by Game.determineTeamPose, or by the keyboard
 		self.dir = 0
 
 		self.moverate = moverate
@@ -302,13 +302,20 @@ class CountDown(Text):
 	
 class Game(object):
 	"""
-	Game(WindowSize, WindowTitle, BackgroundColor, FPS) -> Game
+	Game(WindowSize, WindowTitle, BackgroundColor, FPS, CrowdPose) -> Game
 
 	The core game object that handles everything for the game.
+	The paddles follow the crowd pose from CrowdPose (see crowdpose.py)
+	if one is given, and the keyboard otherwise.
 
 	[Further information on this class is not currently available]
 	"""
-	def __init__(self, size = (1080, 720), caption = "Crowdface Pong", bgcolor = pygame.Color("black"), FPS = 60):
+	# Poses from -1 to 1 closer to 0 than this leave the paddle still
+	poseDeadZone = 0.2
+	# Ignore poses from frames older than this many seconds, e.g. if the camera stops
+	poseMaxAge = 1.0
+
+	def __init__(self, size = (1080, 720), caption = "Crowdface Pong", bgcolor = pygame.Color("black"), FPS = 60, pose = None):
 		pygame.init()
 		pygame.display.set_caption(caption)
 
@@ -316,6 +323,8 @@ class Game(object):
 		self.screen = pygame.display.set_mode(self.size)
 		self.FPS = FPS
 		self.bgcolor = bgcolor
+		self.pose = pose
+		self.poseActive = False
 
 		self.clock = pygame.time.Clock()
 		self.running = True
@@ -438,22 +447,41 @@ class Game(object):
 	
 	def getCrowdPose(self):
 		"""
-		getCrowdPose() -> undetermined data type
-		Retrieve the crowd pose. This will probably just consist of
-		a forward pass through the pose estimation convnet.
-		[Not yet implemented]
-		"""
-		return
+		getCrowdPose() -> ((pose, faces), (pose, faces)) or None
+		The latest average pose of each team, as published by the
+		CrowdPose threads, or None if there isn't a recent one.
+		This only reads what was last published, so it never waits
+		on the camera or the convnet.
+		"""
+		if not self.pose:
+			return None
+		latest = self.pose.latest
+		if not latest or time.time() - latest[0] > self.poseMaxAge:
+			return None
+		return latest[1]
 	
 	def determineTeamPose(self):
 		"""
 		determineTeamPose() -> None
-		Use the data gathered by getCrowdPose to
-		determine the average pose for each team.
-		[Not yet implemented]
+		Use the data gathered by getCrowdPose to set the direction
+		of each team's paddle: up if the team is looking up, down if
+		it's looking down, and still if it's level or has no faces.
+		Without a recent pose, the paddles are left to the keyboard.
 		"""
 		pose = self.getCrowdPose()
-		return
+		if pose is None:
+			# The camera stopped, so stop the paddles it was moving
+			if self.poseActive:
+				for team in self.teams:
+					team.paddle.dir = 0
+				self.poseActive = False
+			return
+		self.poseActive = True
+		for team, (teamPose, faces) in zip(self.teams, pose):
+			if teamPose is None or abs(teamPose) < self.poseDeadZone:
+				team.paddle.dir = 0
+			else:
+				team.paddle.dir = 1 if teamPose > 0 else -1
 	
 	def update(self):
 		"""
@@ -522,6 +550,31 @@ class Game(object):
 			self.render()
 			self.clock.tick(self.FPS)
 	
+def parse_args():
+	"""Parse input arguments."""
+	parser = argparse.ArgumentParser(description='Crowdface pong')
+	parser.add_argument('--source', default='0',
+						help='Camera number, video file, or directory of images to watch the crowd in [0]')
+	parser.add_argument('--keyboard', action='store_true',
+						help="Control the paddles with the keyboard (w/s and up/down) only, without the camera")
+	parser.add_argument('--pitch-model', dest='pitch_model',
+						help='Pitch net weights, a caffemodel or exported .npz, relative to ~/caffe-model-project/ '
+						'[models/train_pitch_iter_50000.caffemodel]')
+	return parser.parse_args()
+
 if __name__ == "__main__":
-	Game().mainLoop()
-	pygame.quit()
+	args = parse_args()
+	pose = None
+	if not args.keyboard:
+		# only imported when it's used, so the keyboard game doesn't need caffe or OpenCV
+		import crowdpose
+		model = crowdpose.PITCH_MODEL
+		if args.pitch_model:
+			model = os.path.join(crowdpose.model_dir, os.path.expanduser(args.pitch_model))
+		pose = crowdpose.CrowdPose(args.source, model=model)
+	try:
+		Game(pose = pose).mainLoop()
+	finally:
+		if pose:
+			pose.close()
+		pygame.quit()
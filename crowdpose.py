@@ -0,0 +1,131 @@
+#!/usr/bin/python
+# Crowd pose estimation for crowdfacepong.py, off the game's render thread.
+# One thread keeps the newest camera frame, another finds the faces in it
+# with the Haar cascade, classifies each one's pitch with the pitch net,
+# and publishes the average pose of each half of the crowd. The game only
+# ever reads the last published value, so it never waits on any of this.
+import sys, os, time, threading
+import numpy as np
+import cv2
+import webcam, backend
+
+model_dir = os.path.expanduser('~/caffe-model-project/')
+CASCADE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'haarcascade_frontalface_default.xml')
+PITCH_DEPLOY = model_dir + 'deploy-pitch.prototxt'
+PITCH_MODEL = model_dir + 'models/train_pitch_iter_50000.caffemodel'
+
+def pitch_pose(probs):
+	"""
+	pitch_pose(Probabilities) -> (poses, is face) for each row
+	Rows are the pitch net's outputs: not a face, then the pitch bins of
+	aflw.angle_bin, down, level and up. The pose is how much more likely
+	up is than down among the face classes, from -1 (down) to 1 (up).
+	"""
+	faces = probs[:, 1:].sum(axis=1)
+	pose = (probs[:, 3] - probs[:, 1]) / np.maximum(faces, 1e-6)
+	return pose, probs[:, 0] < faces
+
+class CrowdPose(object):
+	"""
+	CrowdPose(Source, Cascade, Deploy, Model, MaxFaces, Mirror) -> CrowdPose
+
+	Estimates the pose of the two halves of a crowd on background threads
+	from Source (a camera number, video file or directory of images, as
+	webcam.open_source takes). Each face's centre decides its team: the
+	left half of the frame is team 0 and the right half team 1, after
+	flipping the frame like a mirror if Mirror, so the crowd's left is the
+	screen's left. Only the MaxFaces biggest faces of a frame are classified.
+
+	latest is None until the first frame is done, then (capture time,
+	((pose, faces), (pose, faces))) for the two teams, where pose is the
+	mean of pitch_pose over the team's faces, or None if it has none.
+	It's replaced whole each time, and reading an attribute can't see
+	one half-written, so readers need no lock and never wait.
+	"""
+	def __init__(self, source='0', cascade=CASCADE, deploy=PITCH_DEPLOY, model=PITCH_MODEL,
+				 max_faces=32, mirror=True):
+		self.cascade = cv2.CascadeClassifier(cascade)
+		if self.cascade.empty():
+			raise IOError("Couldn't load the cascade "+cascade)
+		self.deploy, self.model = deploy, model
+		self.max_faces = max_faces
+		self.mirror = mirror
+		self.latest = None
+		self.error = None
+		self.frames = webcam.Latest()
+		self.captured, self.estimated = webcam.RateCounter(), webcam.RateCounter()
+		self.stop = threading.Event()
+		self.video_capture = webcam.open_source(source)
+		self.threads = [threading.Thread(target=webcam.capture,
+							args=(self.video_capture, self.frames, self.captured, self.stop)),
+						threading.Thread(target=self.run)]
+		for t in self.threads:
+			t.daemon = True
+			t.start()
+
+	def run(self):
+		"""
+		run() -> None
+		The estimating thread. The net is loaded here rather than in
+		__init__, so the game starts without waiting for it, and so it
+		runs on the thread that loaded it, as caffe wants.
+		"""
+		try:
+			net, transformer = backend.load_model(self.deploy, self.model)
+		except Exception as e:
+			self.error = '{}: {}'.format(type(e).__name__, e)
+			print "Crowd pose disabled, couldn't load the pitch net ({:s})".format(self.error)
+			return
+		shape = net.blobs['data'].data.shape[1:]
+		seq = 0
+		while not self.stop.is_set():
+			seq, item = self.frames.get(seq, timeout=0.1)
+			if item is None:
+				continue
+			frame, captured = item
+			if self.mirror:
+				frame = cv2.flip(frame, 1)
+			gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+			faces = sorted(webcam.detect_faces(self.cascade, gray), key=lambda f: -f[2] * f[3])[:self.max_faces]
+			teams = ([], [])
+			if faces:
+				rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+				crops = np.array([cv2.resize(rgb[y:y+h, x:x+w], shape[:0:-1], interpolation=cv2.INTER_AREA)
+					for x, y, w, h in faces])
+				if net.blobs['data'].data.shape[0] != len(faces):
+					net.blobs['data'].reshape(len(faces), *shape)
+				transformer.preprocess(crops, net.blobs['data'].data)
+				pose, is_face = pitch_pose(net.forward()['prob'])
+				mid = frame.shape[1] / 2.0
+				for (x, y, w, h), p, f in zip(faces, pose, is_face):
+					# the cascade's false positives
+					if f:
+						teams[0 if x + w / 2.0 < mid else 1].append(p)
+			self.latest = (captured, tuple((float(np.mean(t)) if t else None, len(t)) for t in teams))
+			# latency from the frame being captured to its pose being published
+			self.estimated.tick(time.time() - captured)
+
+	def close(self):
+		"""
+		close() -> None
+		Stop the threads and release the camera.
+		"""
+		self.stop.set()
+		for t in self.threads:
+			t.join(1.0)
+		self.video_capture.release()
+
+if __name__ == '__main__':
+	# print the crowd pose as it's estimated, to check the camera and nets
+	pose = CrowdPose(*sys.argv[1:2])
+	try:
+		while not pose.stop.is_set() and not pose.error:
+			time.sleep(0.5)
+			if pose.latest:
+				captured, teams = pose.latest
+				print '{:s}, {:.1f} fps, {:.0f} ms behind'.format(' | '.join('team {:d}: {:s} ({:d} faces)'.format(
+					n + 1, 'no pose' if p is None else '{:+.2f}'.format(p), count) for n, (p, count) in enumerate(teams)),
+					pose.estimated.rate, pose.estimated.mean * 1000)
+	except KeyboardInterrupt:
+		pass
+	pose.close()
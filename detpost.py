@@ -0,0 +1,229 @@
+#!/usr/bin/python
+# Post-processing of Faster R-CNN outputs: thresholding, then NMS of
+# what's left, optionally soft-NMS and a cap on detections.
+# The NMS is py-faster-rcnn's compiled one when it can be imported, and
+# a NumPy one over all the classes at once otherwise.
+# Run on its own, it times itself against NMS on every proposal, as
+# run-rcnn.py's demo did, on synthetic proposals and checks they keep
+# the same detections.
+import sys, os, time, argparse
+import numpy as np
+
+try:
+	sys.path.append(os.path.expanduser('~/py-faster-rcnn/tools'))
+	import _init_paths
+	from fast_rcnn.nms_wrapper import nms as kernel_nms
+except ImportError:
+	kernel_nms = None
+
+def candidates(scores, boxes, thresh):
+	"""
+	candidates(Scores, Boxes, Thresh) -> (Classes, Boxes, Scores)
+	Every (proposal, class) pair but the background scoring at least
+	Thresh, so nothing below it costs any more than this comparison.
+	Boxes is im_detect's N x 4*classes array.
+	"""
+	prop, cls = np.nonzero(scores[:, 1:] >= thresh)
+	cls += 1
+	return cls, boxes.reshape(len(boxes), scores.shape[1], 4)[prop, cls], scores[prop, cls]
+
+def overlaps(a, b):
+	"""
+	overlaps(BoxesA, BoxesB) -> len(BoxesA) x len(BoxesB) intersection over union
+	With py-faster-rcnn's inclusive pixel coordinates.
+	"""
+	w = np.minimum(a[:, np.newaxis, 2], b[:, 2])
+	w -= np.maximum(a[:, np.newaxis, 0], b[:, 0])
+	w += 1
+	h = np.minimum(a[:, np.newaxis, 3], b[:, 3])
+	h -= np.maximum(a[:, np.newaxis, 1], b[:, 1])
+	h += 1
+	inter = np.maximum(w, 0, w)
+	inter *= np.maximum(h, 0, h)
+	area_a = (a[:, 2] - a[:, 0] + 1) * (a[:, 3] - a[:, 1] + 1)
+	area_b = (b[:, 2] - b[:, 0] + 1) * (b[:, 3] - b[:, 1] + 1)
+	union = area_a[:, np.newaxis] + area_b
+	union -= inter
+	inter /= union
+	return inter
+
+def nms_order(cls, boxes, scores, nms_thresh, top_k=None, block=128):
+	"""
+	nms_order(Classes, Boxes, Scores, NMSThresh, TopK, Block) -> indices kept, highest scoring first
+	Greedy NMS within each class, for all the classes after sorting once,
+	by class and then score, so each class's boxes are together and no
+	time goes on comparing boxes of different classes. It works through
+	them Block boxes at a time: a block first loses every box that overlaps
+	one of its class already kept, all in one go. Then which of the rest
+	suppress each other is settled by repeating "kept if nothing kept
+	before it overlaps it" over the block until nothing changes, which
+	leaves exactly what greedy NMS keeps.
+	Like nms_wrapper's CPU NMS, an overlap of NMSThresh or more suppresses.
+	TopK keeps only the highest scoring over all classes.
+	"""
+	order = np.lexsort((-scores, cls))
+	boxes = boxes[order].astype(np.float32)
+	kept = np.zeros(len(order), dtype=bool)
+	starts = np.flatnonzero(np.diff(cls[order])) + 1
+	for first, end in zip(np.r_[0, starts], np.r_[starts, len(order)]):
+		for b in xrange(first, end, block):
+			alive = np.arange(b, min(b+block, end))
+			prev = boxes[first:b][kept[first:b]]
+			if len(prev):
+				alive = alive[~(overlaps(prev, boxes[alive]) >= nms_thresh).any(axis=0)]
+			# which of the rest would suppress which later ones
+			suppresses = np.triu(overlaps(boxes[alive], boxes[alive]) >= nms_thresh, 1)
+			keep = np.ones(len(alive), dtype=bool)
+			while True:
+				new = ~suppresses[keep].any(axis=0)
+				if (new == keep).all():
+					break
+				keep = new
+			kept[alive[keep]] = True
+	keep = order[kept]
+	keep = keep[np.argsort(-scores[keep], kind='mergesort')]
+	return keep[:top_k]
+
+def soft_nms(cls, boxes, scores, nms_thresh, thresh, method='linear', sigma=0.5, top_k=None):
+	"""
+	soft_nms(Classes, Boxes, Scores, NMSThresh, Thresh, Method, Sigma, TopK) -> (indices, new scores)
+	Soft-NMS (Bodla et al. 2017): instead of dropping boxes that overlap a
+	better one, lower their scores, by (1 - overlap) for overlaps above
+	NMSThresh ('linear') or by exp(-overlap^2 / Sigma) ('gaussian').
+	Boxes whose scores fall under Thresh are dropped.
+	Only boxes of the same class affect each other.
+	"""
+	x1, y1, x2, y2 = [boxes[:, i].astype(np.float64) for i in xrange(4)]
+	areas = (x2 - x1 + 1) * (y2 - y1 + 1)
+	scores = scores.astype(np.float64)
+	active = np.arange(len(scores))
+	keep, kept_scores = [], []
+	while active.size:
+		best = np.argmax(scores[active])
+		i = active[best]
+		keep.append(i)
+		kept_scores.append(scores[i])
+		if top_k and len(keep) >= top_k:
+			break
+		rest = np.delete(active, best)
+		w = np.maximum(0.0, np.minimum(x2[i], x2[rest]) - np.maximum(x1[i], x1[rest]) + 1)
+		h = np.maximum(0.0, np.minimum(y2[i], y2[rest]) - np.maximum(y1[i], y1[rest]) + 1)
+		inter = w * h
+		overlap = inter / (areas[i] + areas[rest] - inter)
+		overlap[cls[rest] != cls[i]] = 0
+		if method == 'gaussian':
+			scores[rest] *= np.exp(-overlap * overlap / sigma)
+		else:
+			scores[rest] *= np.where(overlap >= nms_thresh, 1 - overlap, 1)
+		active = rest[scores[rest] >= thresh]
+	return np.array(keep, dtype=np.intp), np.array(kept_scores, dtype=np.float32)
+
+def nms_classes(cls, boxes, scores, nms_thresh, top_k=None, kernel=kernel_nms):
+	"""
+	nms_classes(Classes, Boxes, Scores, NMSThresh, TopK, Kernel) -> indices kept, highest scoring first
+	Greedy NMS within each class. Kernel is an NMS like nms_wrapper.nms,
+	run on each class in turn, or None for nms_order. Once the threshold
+	has left few boxes, the compiled kernel is faster than nms_order
+	however many classes there are.
+	"""
+	if kernel is None:
+		return nms_order(cls, boxes, scores, nms_thresh, top_k)
+	keep = [np.zeros(0, dtype=np.intp)]
+	for c in np.unique(cls):
+		idx = np.flatnonzero(cls == c)
+		dets = np.hstack((boxes[idx], scores[idx, np.newaxis])).astype(np.float32)
+		keep.append(idx[kernel(dets, nms_thresh)])
+	keep = np.hstack(keep)
+	keep = keep[np.argsort(-scores[keep], kind='mergesort')]
+	return keep[:top_k]
+
+def postprocess(scores, boxes, thresh, nms_thresh, soft=None, sigma=0.5, top_k=None, kernel=kernel_nms):
+	"""
+	postprocess(Scores, Boxes, Thresh, NMSThresh, Soft, Sigma, TopK, Kernel) -> list of N x 5 arrays
+	The (x1, y1, x2, y2, score) detections of each class but the background,
+	highest scoring first, from im_detect's Scores and Boxes.
+	Thresholds first, then runs NMS on what's left with nms_classes and
+	Kernel, where boxes only suppress others of their own class. Soft is
+	None for plain NMS, or 'linear' or 'gaussian' for soft-NMS.
+	TopK caps the detections over all classes.
+	"""
+	nclasses = scores.shape[1]
+	cls, cboxes, cscores = candidates(scores, boxes, thresh)
+	if len(cls):
+		if soft:
+			keep, cscores = soft_nms(cls, cboxes, cscores, nms_thresh, thresh, soft, sigma, top_k)
+		else:
+			keep = nms_classes(cls, cboxes, cscores, nms_thresh, top_k, kernel)
+			cscores = cscores[keep]
+		cls, cboxes = cls[keep], cboxes[keep]
+	dets = np.hstack((cboxes, cscores[:, np.newaxis])).astype(np.float32)
+	return [dets[cls == c] for c in xrange(1, nclasses)]
+
+def synthetic(rng, nproposals, nclasses):
+	"""
+	synthetic(RandomState, Proposals, Classes) -> (Scores, Boxes) like im_detect's
+	Proposals clustered around a few objects, most of them confidently
+	background and the rest confidently one class, as a trained net gives.
+	"""
+	centres = rng.uniform(100, 900, (8, 2))
+	c = centres[rng.randint(0, len(centres), nproposals)] + rng.normal(0, 20, (nproposals, 2))
+	size = rng.uniform(30, 150, (nproposals, 1)) * [1, 1]
+	b = np.hstack((c - size / 2, c + size / 2)).clip(0, 999)
+	boxes = np.tile(b, nclasses) + rng.normal(0, 3, (nproposals, 4 * nclasses))
+	logits = rng.normal(0, 1.5, (nproposals, nclasses))
+	truth = np.where(rng.uniform(size=nproposals) < 0.7, 0, rng.randint(1, nclasses, nproposals))
+	logits[np.arange(nproposals), truth] += 5
+	scores = np.exp(logits)
+	scores /= scores.sum(axis=1, keepdims=True)
+	return scores.astype(np.float32), boxes.clip(0, 999).astype(np.float32)
+
+def baseline(nms, scores, boxes, thresh, nms_thresh):
+	"""
+	baseline(NMS, Scores, Boxes, Thresh, NMSThresh) -> list of N x 5 arrays
+	What run-rcnn.py's demo did: NMS on every proposal of each class,
+	then the threshold.
+	"""
+	all_dets = []
+	for cls_ind in xrange(1, scores.shape[1]):
+		cls_boxes = boxes[:, 4*cls_ind:4*(cls_ind + 1)]
+		cls_scores = scores[:, cls_ind]
+		dets = np.hstack((cls_boxes,
+						  cls_scores[:, np.newaxis])).astype(np.float32)
+		keep = nms(dets, nms_thresh)
+		dets = dets[keep, :]
+		all_dets.append(dets[dets[:, -1] >= thresh])
+	return all_dets
+
+def parse_args():
+	"""Parse input arguments."""
+	parser = argparse.ArgumentParser(description='Time detpost against NMS on every proposal')
+	parser.add_argument('--proposals', default='300,2000,6000',
+						help='Comma-separated proposal counts [300,2000,6000]')
+	parser.add_argument('--classes', default=2, type=int, help='Classes, with the background [2]')
+	parser.add_argument('--thresh', default=0.05, type=float, help='Score threshold [0.05]')
+	parser.add_argument('--nms', default=0.3, type=float, help='NMS overlap threshold [0.3]')
+	parser.add_argument('--repeat', default=20, type=int, help='Runs of each to time [20]')
+	return parser.parse_args()
+
+if __name__ == '__main__':
+	args = parse_args()
+	if kernel_nms is None:
+		sys.exit("Couldn't import py-faster-rcnn's nms_wrapper to compare against")
+
+	rng = np.random.RandomState(0)
+	print '{:>5s} {:>7s} {:>12s} {:>12s} {:>12s}'.format('boxes', 'classes', 'every box', 'detpost', 'NumPy NMS')
+	for n in [int(p) for p in args.proposals.split(',')]:
+		scores, boxes = synthetic(rng, n, args.classes)
+		expected = baseline(kernel_nms, scores, boxes, args.thresh, args.nms)
+		times = []
+		same = True
+		for f in (lambda: baseline(kernel_nms, scores, boxes, args.thresh, args.nms),
+				  lambda: postprocess(scores, boxes, args.thresh, args.nms),
+				  lambda: postprocess(scores, boxes, args.thresh, args.nms, kernel=None)):
+			start = time.time()
+			for _ in xrange(args.repeat):
+				got = f()
+			times.append((time.time() - start) / args.repeat)
+			same &= all(len(e) == len(g) and np.allclose(e, g) for e, g in zip(expected, got))
+		print '{:5d} {:7d} {:9.2f} ms {:9.2f} ms {:9.2f} ms  {:s}'.format(n, args.classes,
+			times[0] * 1000, times[1] * 1000, times[2] * 1000, 'same detections' if same else 'DIFFERENT detections')
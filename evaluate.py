@@ -0,0 +1,147 @@
+#!/usr/bin/python
+# Measures the Faster R-CNN face detector against the PASCAL annotations
+# make_imdb_annotations.py writes: average precision at several overlap
+# thresholds, and how long detection takes per image, e.g.
+#   ./evaluate.py --set ~/caffe-model-project/AFLW_Faster_RCNN/data/ImageSets/test.txt \
+#                 --cpu --output eval.json
+# Takes the same detection options as run-rcnn.py (--thresh, --nms,
+# --soft-nms, --top-k, --tile, --scales...), so a faster setting can be
+# checked for what it costs in accuracy in the same run.
+import sys, os, re, time, json, platform, argparse
+import numpy as np
+import cv2
+import prefetch, detpost, benchmark, rcnn
+
+annotdir = os.path.expanduser('~/caffe-model-project/AFLW_Faster_RCNN/data/Annotations/')
+IMAGE_RE = re.compile(r'Image filename : "(.*)"')
+BOX_RE = re.compile(r'\(Xmin, Ymin\) - \(Xmax, Ymax\) : \((-?\d+), (-?\d+)\) - \((-?\d+), (-?\d+)\)')
+
+def parse_annotation(path):
+	"""
+	parse_annotation(Path) -> (ImagePath, N x 4 array of face boxes)
+	"""
+	with open(path) as f:
+		text = f.read()
+	boxes = np.array(BOX_RE.findall(text), dtype=np.float32).reshape(-1, 4)
+	return os.path.expanduser(IMAGE_RE.search(text).group(1)), boxes
+
+def list_annotations(annotdir, image_set=None):
+	"""
+	list_annotations(AnnotationDir, ImageSet) -> list of annotation paths
+	Every annotation in AnnotationDir, or the ones named on each line of
+	ImageSet (without the .txt, like py-faster-rcnn's ImageSets lists).
+	"""
+	if image_set:
+		with open(image_set) as f:
+			return [os.path.join(annotdir, l.split()[0] + '.txt') for l in f if l.strip()]
+	return [os.path.join(annotdir, name) for name in sorted(os.listdir(annotdir)) if name.endswith('.txt')]
+
+def match(dets, gt, iou_threshes):
+	"""
+	match(Detections, GroundTruth, IoUThresholds) -> len(IoUThresholds) x len(Detections) true positives
+	Detections are N x 5, highest scoring first. As in the PASCAL VOC
+	evaluation, each detection is a true positive if the face it overlaps
+	most overlaps it by at least the threshold and no higher scoring
+	detection already took that face. All the overlaps are found at
+	once, and a detection taking a face comes down to being the first
+	over the threshold to have it as its best.
+	"""
+	tp = np.zeros((len(iou_threshes), len(dets)), dtype=bool)
+	if not len(dets) or not len(gt):
+		return tp
+	ov = detpost.overlaps(dets[:, :4].astype(np.float64), gt.astype(np.float64))
+	best, best_ov = ov.argmax(axis=1), ov.max(axis=1)
+	for t, thresh in enumerate(iou_threshes):
+		over = np.nonzero(best_ov >= thresh)[0]
+		# np.unique gives where each face first appears
+		firsts = np.unique(best[over], return_index=True)[1]
+		tp[t, over[firsts]] = True
+	return tp
+
+def average_precision(scores, tp, npos):
+	"""
+	average_precision(Scores, TruePositives, Positives) -> AP
+	The area under the precision/recall curve, with precision made to only
+	ever fall as recall rises, as in the PASCAL VOC 2010 onwards evaluation.
+	"""
+	if not npos:
+		return 0.0
+	order = np.argsort(-scores, kind='mergesort')
+	tps = np.cumsum(tp[order])
+	recall = np.r_[0, tps / float(npos), 1]
+	precision = np.r_[0, tps / np.arange(1.0, len(tps) + 1), 0]
+	precision = np.maximum.accumulate(precision[::-1])[::-1]
+	i = np.nonzero(recall[1:] != recall[:-1])[0]
+	return float(((recall[i + 1] - recall[i]) * precision[i + 1]).sum())
+
+def evaluate(net, detect, annotations, iou_threshes, cls_ind=1):
+	"""
+	evaluate(Net, Detect, AnnotationPaths, IoUThresholds, ClassIndex) -> result dict
+	Run Detect(Net, Image), as from rcnn.detector, over every annotated
+	image (loading the next ones on a background thread meanwhile), and
+	score class ClassIndex's detections against the annotated faces.
+	Latency is only the time in Detect, not loading the image.
+	"""
+	truth = [parse_annotation(a) for a in annotations]
+	npos = sum(len(gt) for image, gt in truth)
+	scores, tps, times, latencies = [], [], [], {}
+	for i, ((image, gt), im) in enumerate(prefetch.prefetched(truth, lambda t: cv2.imread(t[0]))):
+		if im is None:
+			print '\nCould not read {:s}'.format(image)
+			continue
+		start = time.time()
+		dets = detect(net, im)[cls_ind - 1]
+		times.append(time.time() - start)
+		latencies[image] = times[-1] * 1000
+		dets = dets[np.argsort(-dets[:, 4], kind='mergesort')]
+		scores.append(dets[:, 4])
+		tps.append(match(dets, gt, iou_threshes))
+		sys.stdout.write('\r{:d} / {:d} images, {:.3f}s per image'.format(i + 1, len(truth), np.mean(times)))
+		sys.stdout.flush()
+	sys.stdout.write('\n')
+	scores = np.hstack(scores) if scores else np.zeros(0, np.float32)
+	tps = np.hstack(tps) if tps else np.zeros((len(iou_threshes), 0), bool)
+	ap = [average_precision(scores, tp, npos) for tp in tps]
+	return {'images': len(times), 'faces': npos, 'detections': len(scores),
+		'ap': dict(('{:.2f}'.format(t), a) for t, a in zip(iou_threshes, ap)),
+		'map': float(np.mean(ap)),
+		'latency_ms': benchmark.percentiles(times) if times else None,
+		'images_per_s': len(times) / sum(times) if times else 0.0,
+		'latency_per_image_ms': latencies}
+
+def parse_args():
+	"""Parse input arguments."""
+	parser = argparse.ArgumentParser(description='Evaluate the Faster R-CNN face detector')
+	rcnn.add_args(parser)
+	parser.add_argument('--annotations', default=annotdir,
+						help='Directory of PASCAL annotations ['+annotdir+']')
+	parser.add_argument('--set', dest='image_set',
+						help='List of the annotations to use, one name per line [all of them]')
+	parser.add_argument('--limit', type=int, help='Only evaluate the first this many images')
+	parser.add_argument('--iou', default='0.5,0.55,0.6,0.65,0.7,0.75,0.8,0.85,0.9,0.95',
+						help='Comma-separated overlap thresholds [0.5,0.55,...,0.95]')
+	parser.add_argument('--output', help='JSON file to save the report to')
+	args = parser.parse_args()
+	rcnn.check_args(parser, args)
+	return args
+
+if __name__ == '__main__':
+	args = parse_args()
+	annotations = list_annotations(os.path.expanduser(args.annotations),
+		args.image_set and os.path.expanduser(args.image_set))[:args.limit]
+	iou_threshes = [float(t) for t in args.iou.split(',')]
+	net = rcnn.load_net(args)
+	r = evaluate(net, rcnn.detector(args), annotations, iou_threshes, rcnn.CLASSES.index('face'))
+
+	print '{:d} images, {:d} faces, {:d} detections'.format(r['images'], r['faces'], r['detections'])
+	for t in iou_threshes:
+		print 'AP @ IoU {:.2f}: {:.4f}'.format(t, r['ap']['{:.2f}'.format(t)])
+	print 'mAP over IoU {:s}: {:.4f}'.format(args.iou, r['map'])
+	if r['latency_ms']:
+		print '{:.2f} images/s, latency mean/p50/p95/p99 {:.1f}/{:.1f}/{:.1f}/{:.1f} ms'.format(r['images_per_s'],
+			r['latency_ms']['mean'], r['latency_ms']['p50'], r['latency_ms']['p95'], r['latency_ms']['p99'])
+	if args.output:
+		r['settings'] = vars(args)
+		with open(args.output, 'w') as f:
+			json.dump({'host': platform.node(), 'machine': platform.machine(), 'cpus': os.sysconf('SC_NPROCESSORS_ONLN'),
+				'time': time.strftime('%Y-%m-%d %H:%M:%S'), 'results': r}, f, indent=1, sort_keys=True)
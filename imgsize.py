@@ -0,0 +1,104 @@
+#!/usr/bin/python
+# Finds image dimensions from the JPEG/PNG headers alone, without decoding
+# or even reading the rest of the file, and keeps a cache of them on disk
+import os, struct
+from PIL import Image
+
+# JPEG start-of-frame markers, the ones that hold the image dimensions
+SOF_MARKERS = set(range(0xC0, 0xD0)) - set([0xC4, 0xC8, 0xCC])
+
+def jpeg_size(f):
+	"""
+	jpeg_size(File) -> (Width, Height) or None
+	Walk the JPEG marker segments, seeking past each one, until a frame header.
+	"""
+	if f.read(2) != '\xff\xd8':
+		return None
+	while True:
+		b = f.read(1)
+		if not b:
+			return None
+		if b != '\xff':
+			continue
+		# markers can be padded with any number of 0xff bytes
+		while b == '\xff':
+			b = f.read(1)
+		marker = ord(b) if b else None
+		if marker is None or marker == 0xD9:
+			return None
+		# these markers don't have a segment after them
+		if marker == 0x01 or 0xD0 <= marker <= 0xD8:
+			continue
+		length = struct.unpack('>H', f.read(2))[0]
+		if marker in SOF_MARKERS:
+			height, width = struct.unpack('>xHH', f.read(5))
+			return (width, height)
+		f.seek(length - 2, 1)
+
+def png_size(f):
+	"""
+	png_size(File) -> (Width, Height) or None
+	The dimensions are the first thing in the IHDR chunk, which always comes first.
+	"""
+	head = f.read(24)
+	if len(head) < 24 or head[:8] != '\x89PNG\r\n\x1a\n' or head[12:16] != 'IHDR':
+		return None
+	return struct.unpack('>II', head[16:24])
+
+def probe(path):
+	"""
+	probe(Path) -> (Width, Height)
+	Read the dimensions from the image header, falling back
+	to PIL (which still only reads the header) for anything else.
+	"""
+	with open(path, 'rb') as f:
+		size = jpeg_size(f)
+		if size is None:
+			f.seek(0)
+			size = png_size(f)
+	if size is None:
+		size = Image.open(path).size
+	return size
+
+class SizeCache(object):
+	"""
+	SizeCache(CachePath) -> SizeCache
+
+	A small index of image dimensions keyed by path and modification time,
+	saved as lines of "mtime width height path". An image is only probed
+	again if its mtime has changed since it was cached.
+	"""
+	def __init__(self, cachepath):
+		self.cachepath = cachepath
+		self.sizes = {}
+		self.changed = False
+		if os.path.isfile(cachepath):
+			with open(cachepath) as f:
+				for l in f:
+					mtime, w, h, path = l.rstrip('\n').split(' ', 3)
+					self.sizes[path] = (float(mtime), int(w), int(h))
+
+	def get(self, path):
+		"""
+		get(Path) -> (Width, Height)
+		"""
+		mtime = os.path.getmtime(path)
+		cached = self.sizes.get(path)
+		if cached and cached[0] == mtime:
+			return cached[1:]
+		size = probe(path)
+		self.sizes[path] = (mtime,) + tuple(size)
+		self.changed = True
+		return size
+
+	def save(self):
+		"""
+		save() -> None
+		Write the index back out, if anything new was probed.
+		"""
+		if not self.changed:
+			return
+		with open(self.cachepath, 'w') as f:
+			for path in sorted(self.sizes):
+				f.write('{!r} {:d} {:d} {}\n'.format(*(self.sizes[path] + (path,))))
+		self.changed = False
@@ -5,7 +5,8 @@
 # that py-faster-rcnn uses for its training image database
 
 import os, sys, time, datetime
-from PIL import Image
+from multiprocessing.pool import ThreadPool
+import imgsize
 
 class ImgFace(object):
 	def __init__(self, imgpath, annotpath, width, height):
@@ -20,60 +21,96 @@ class ImgFace(object):
 			self.faces.append((x, y, x+w, y+h))
 			#self.faces.append((max(x, 0), max(y, 0), min(x+w, self.w), min(y+h, self.h)))
 			self.n += 1
+	def annotation(self):
+		annot_text = '''\
+# PASCAL Annotation Version 1.00
+
+Image filename : "{}"
+Image size (X x Y x C) : {:d} x {:d} x 3
+Database : "The Annotated Facial Landmarks in the Wild database"
+Objects with ground truth : {:d} {{ {} }}
+
+# Top left pixel co-ordinates : (0, 0)
+
+'''.format(self.ip, self.w, self.h, self.n, ' '.join(['"PASface"'] * self.n))
+		for n in range(self.n):
+			annot_text += '''# Details for object {num} ("PASface")
+Original label for object {num} "PASface" : "face"
+Bounding box for object {num} "PASface" (Xmin, Ymin) - (Xmax, Ymax) : ({:d}, {:d}) - ({:d}, {:d})
+
+'''.format(num=n+1, *self.faces[n])
+		return annot_text
+
+def write_annotation(imf):
+	"""
+	write_annotation(ImgFace) -> (ImgFace, Status)
+	Write the annotation file for one image, unless the file
+	already has exactly the same contents.
+	Status is 'written', 'unchanged' or 'error'.
+	"""
+	annot_text = imf.annotation()
+	try:
+		# a file of another size can't match, so only read the ones that might
+		if os.path.isfile(imf.ap) and os.path.getsize(imf.ap) == len(annot_text):
+			with open(imf.ap) as f:
+				if f.read() == annot_text:
+					return (imf, 'unchanged')
+		with open(imf.ap, 'w') as f:
+			f.write(annot_text)
+		return (imf, 'written')
+	except IOError:
+		return (imf, 'error')
 
 with open(os.path.expanduser('~/aflw/frp.txt')) as f:
 	facedata = [x.split() for x in f.readlines()]
 
+# the annotation files are written by a pool of threads, 8 unless given
+if len(sys.argv) > 1:
+	nthreads = int(sys.argv[1])
+else:
+	nthreads = 8
+
 #thispath = os.path.dirname(os.path.realpath(__file__))
 imgdir = os.path.expanduser('~/caffe-model-project/AFLW_Faster_RCNN/data/Images/')
 annotdir = os.path.expanduser('~/caffe-model-project/AFLW_Faster_RCNN/data/Annotations/')
+# image sizes are read from the file headers and cached by path and mtime,
+# so re-running this hardly touches the images at all
+sizes = imgsize.SizeCache(os.path.expanduser('~/caffe-model-project/AFLW_Faster_RCNN/data/image_sizes.txt'))
 
+# one entry per image (not per face), in the order they first appear
 imgind = []
 imgface = {}
 
 nfaces=len(facedata)
 for i in range(nfaces):
 	oimgp=facedata[i][1][2:]
-	imgind.append(oimgp)
 	if not imgface.has_key(oimgp):
+		imgind.append(oimgp)
 		imgpath = imgdir + oimgp
 		annotpath = annotdir + oimgp[:oimgp.index('.')] + '.txt'
-		im=Image.open(imgpath)
-		imgface[oimgp] = ImgFace(imgpath, annotpath, *im.size)
+		imgface[oimgp] = ImgFace(imgpath, annotpath, *sizes.get(imgpath))
 	sys.stdout.write('Processed face \033[33m'+str(i+1)+' / '+str(nfaces)+'\033[0m of file \033[1;34m'+str(oimgp)+'\033[0m\n')
 	imgface[oimgp].add_face(*map(int, facedata[i][2:6]))
+sizes.save()
 
-nimages=len(imgind)
-for i in range(nimages):
-	imf=imgface[imgind[i]]
-	if imf.n == 0:
-		continue
-	annot_text = '''\
-# PASCAL Annotation Version 1.00
-
-Image filename : "{}"
-Image size (X x Y x C) : {:d} x {:d} x 3
-Database : "The Annotated Facial Landmarks in the Wild database"
-Objects with ground truth : {:d} {{ {} }}
-
-# Top left pixel co-ordinates : (0, 0)
-
-'''.format(imf.ip, imf.w, imf.h, imf.n, ' '.join(['"PASface"'] * imf.n))
-	
+# images without any faces get no annotation file
+annotated = [imgface[oimgp] for oimgp in imgind if imgface[oimgp].n > 0]
+nimages=len(annotated)
+pool = ThreadPool(nthreads)
+nwritten = 0
+results = pool.imap(write_annotation, annotated)
+for i, (imf, status) in enumerate(results):
 	sys.stdout.write('\nProcessing image \033[35m'+str(imf.ip)+'\033[0m\n')
 	for n in range(imf.n):
 		sys.stdout.write('Face in coordinates \033[34m({:d}, {:d}, {:d}, {:d})\033[0m\n'.format(*imf.faces[n]))
-		annot_text += '''# Details for object {num} ("PASface")
-Original label for object {num} "PASface" : "face"
-Bounding box for object {num} "PASface" (Xmin, Ymin) - (Xmax, Ymax) : ({:d}, {:d}) - ({:d}, {:d})
-
-'''.format(num=n+1, *imf.faces[n])
-	
-	try:
-		with open(imf.ap, 'w') as f:
-			f.write(annot_text)
+	if status == 'written':
+		nwritten += 1
 		sys.stdout.write('Annotations written to \033[32m'+str(imf.ap)+' \033[36m('+str(i+1)+' / '+str(nimages)+')\033[0m\n')
-	except IOError:
+	elif status == 'unchanged':
+		sys.stdout.write('Annotations unchanged in \033[32m'+str(imf.ap)+' \033[36m('+str(i+1)+' / '+str(nimages)+')\033[0m\n')
+	else:
 		sys.stdout.write('\033[41mError writing annotations to '+str(imf.ap)+'...\033[0m\n')
 		raw_input()
-
+pool.close()
+pool.join()
+sys.stdout.write('\n\033[32m'+str(nwritten)+'\033[0m annotation files written\n')
@@ -0,0 +1,219 @@
+#!/usr/bin/python
+# Keeps trained nets loaded and classifies images for other scripts over
+# a Unix socket, so they don't each spend seconds loading the net first.
+# Requests from several clients that arrive together share forward passes.
+# Start it with the models to load up front, e.g.
+#   ./modelserver.py --model deploy.prototxt caffe_train_iter_50000.caffemodel \
+#                    --model deploy-pitch.prototxt models/train_pitch_iter_50000.caffemodel
+# Any other model a client asks for gets loaded (and kept) the first time.
+import sys, os, json, socket, threading, Queue, SocketServer, argparse
+from multiprocessing.pool import ThreadPool
+import numpy as np
+import preprocess, backend
+
+model_dir = os.path.expanduser('~/caffe-model-project/')
+SOCKET_PATH = os.path.expanduser('~/.caffe-modelserver.sock')
+
+class ServerError(Exception):
+	pass
+
+class Pending(object):
+	"""
+	Pending(Data) -> Pending
+	One preprocessed image waiting for its turn in a forward pass.
+	When it's done, either prob or error is set.
+	"""
+	def __init__(self, data):
+		self.data = data
+		self.prob = None
+		self.error = None
+		self.done = threading.Event()
+
+class Model(object):
+	"""
+	Model(Deploy, Model, BatchSize, MaxDelay) -> Model
+
+	A loaded net and the thread that runs it. Images from every client
+	go into one queue, and each forward pass takes as many of them as
+	are waiting, up to BatchSize, after waiting up to MaxDelay seconds
+	for more to arrive once there is one.
+	"""
+	def __init__(self, deploy, model, batch_size=10, max_delay=0.005):
+		self.net, self.transformer = backend.load_model(deploy, model)
+		self.shape = self.net.blobs['data'].data.shape[1:]
+		self.batch_size = batch_size
+		self.max_delay = max_delay
+		self.queue = Queue.Queue()
+		self.thread = threading.Thread(target=self.run)
+		self.thread.daemon = True
+		self.thread.start()
+
+	def run(self):
+		"""
+		run() -> None
+		"""
+		data = self.net.blobs['data']
+		while True:
+			pending = [self.queue.get()]
+			try:
+				while len(pending) < self.batch_size:
+					pending.append(self.queue.get(timeout=self.max_delay))
+			except Queue.Empty:
+				pass
+			n = len(pending)
+			try:
+				if data.data.shape[0] != n:
+					data.reshape(n, *self.shape)
+				for i, p in enumerate(pending):
+					data.data[i] = p.data
+				out = self.net.forward()
+				for i, p in enumerate(pending):
+					p.prob = out['prob'][i].copy()
+			except Exception as e:
+				# fail this batch's requests, but keep serving the next ones
+				for p in pending:
+					p.error = '{}: {}'.format(type(e).__name__, e)
+			for p in pending:
+				p.done.set()
+
+	def classify(self, data):
+		"""
+		classify(list of preprocessed images) -> list of Probabilities
+		Queue the images and wait for the batcher to get through them.
+		Raises ServerError if the forward pass they were in failed.
+		"""
+		pending = [Pending(d) for d in data]
+		for p in pending:
+			self.queue.put(p)
+		for p in pending:
+			p.done.wait()
+		for p in pending:
+			if p.error:
+				raise ServerError(p.error)
+		return [p.prob for p in pending]
+
+class Handler(SocketServer.StreamRequestHandler):
+	"""
+	Handles one client connection, one JSON request per line:
+	{"deploy": Path, "model": Path, "images": [Path, ...]}
+	answered with {"prob": [[...], ...]} or {"error": Message}.
+	"""
+	def handle(self):
+		for l in self.rfile:
+			try:
+				req = json.loads(l)
+				model = self.server.get_model(req['deploy'], req['model'])
+				def load(path):
+					data = np.empty(model.shape, dtype=np.float32)
+					model.transformer.preprocess(preprocess.load_image(path)[np.newaxis], data[np.newaxis])
+					return data
+				# decode on the shared pool, so one client's images load in parallel
+				probs = model.classify(self.server.pool.map(load, req['images']))
+				reply = {'prob': [p.tolist() for p in probs]}
+			except Exception as e:
+				reply = {'error': '{}: {}'.format(type(e).__name__, e)}
+			self.wfile.write(json.dumps(reply)+'\n')
+			self.wfile.flush()
+
+class ModelServer(SocketServer.ThreadingUnixStreamServer):
+	"""
+	ModelServer(SocketPath, BatchSize, MaxDelay, Workers) -> ModelServer
+	"""
+	daemon_threads = True
+
+	def __init__(self, path, batch_size=10, max_delay=0.005, workers=4):
+		SocketServer.ThreadingUnixStreamServer.__init__(self, path, Handler)
+		self.batch_size = batch_size
+		self.max_delay = max_delay
+		self.pool = ThreadPool(workers)
+		self.models = {}
+		self.lock = threading.Lock()
+
+	def get_model(self, deploy, model):
+		"""
+		get_model(Deploy, Model) -> Model
+		Load the model the first time it's asked for.
+		"""
+		key = (os.path.realpath(deploy), os.path.realpath(model))
+		with self.lock:
+			if key not in self.models:
+				print 'Loading {:s}'.format(key[1])
+				self.models[key] = Model(key[0], key[1], self.batch_size, self.max_delay)
+			return self.models[key]
+
+class Client(object):
+	"""
+	Client(Socket) -> Client
+	A connection to a running model server, see connect().
+	"""
+	def __init__(self, sock):
+		self.sock = sock
+		self.f = sock.makefile('rw')
+
+	def classify(self, deploy, model, images):
+		"""
+		classify(Deploy, Model, ImagePaths) -> len(ImagePaths) x classes array of probabilities
+		"""
+		req = {'deploy': os.path.abspath(deploy), 'model': os.path.abspath(model),
+			'images': [os.path.abspath(image) for image in images]}
+		self.f.write(json.dumps(req)+'\n')
+		self.f.flush()
+		reply = self.f.readline()
+		if not reply:
+			raise ServerError('model server closed the connection')
+		reply = json.loads(reply)
+		if 'error' in reply:
+			raise ServerError(reply['error'])
+		return np.array(reply['prob'], dtype=np.float32)
+
+	def close(self):
+		self.f.close()
+		self.sock.close()
+
+def connect(path=SOCKET_PATH):
+	"""
+	connect(SocketPath) -> Client or None if no server is running there
+	"""
+	sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+	try:
+		sock.connect(path)
+	except socket.error:
+		sock.close()
+		return None
+	return Client(sock)
+
+def parse_args():
+	"""Parse input arguments."""
+	parser = argparse.ArgumentParser(description='Serve trained models over a Unix socket')
+	parser.add_argument('--model', nargs=2, action='append', default=[], metavar=('DEPLOY', 'MODEL'),
+						help='Model to load at startup, relative to '+model_dir+' (repeatable)')
+	parser.add_argument('--socket', default=SOCKET_PATH, help='Socket path ['+SOCKET_PATH+']')
+	parser.add_argument('--batch-size', dest='batch_size', default=10, type=int,
+						help='Most images per forward pass [10]')
+	parser.add_argument('--max-delay', dest='max_delay', default=5, type=float,
+						help='Milliseconds to wait for more images to batch up [5]')
+	parser.add_argument('--workers', default=4, type=int,
+						help='Threads loading and preprocessing images [4]')
+	return parser.parse_args()
+
+if __name__ == '__main__':
+	args = parse_args()
+	if os.path.exists(args.socket):
+		client = connect(args.socket)
+		if client:
+			client.close()
+			sys.exit('A model server is already running at '+args.socket)
+		# left behind by a server that didn't shut down cleanly
+		os.remove(args.socket)
+	server = ModelServer(args.socket, args.batch_size, args.max_delay / 1000.0, args.workers)
+	try:
+		for deploy, model in args.model:
+			server.get_model(os.path.join(model_dir, os.path.expanduser(deploy)),
+				os.path.join(model_dir, os.path.expanduser(model)))
+		print 'Serving on {:s}'.format(args.socket)
+		server.serve_forever()
+	except KeyboardInterrupt:
+		pass
+	finally:
+		server.server_close()
+		os.remove(args.socket)
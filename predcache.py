@@ -0,0 +1,127 @@
+#!/usr/bin/python
+# On-disk cache of classifier predictions, keyed by a hash of the image file
+# and a hash of the model (deploy prototxt and weights), so images that
+# haven't changed don't need another forward pass to be scored again
+import os, time, hashlib, sqlite3
+import numpy as np
+
+CACHE_PATH = os.path.expanduser('~/.classify-cache.sqlite')
+
+def hash_file(path):
+	"""
+	hash_file(Path) -> SHA-1 hex digest of the file's contents
+	"""
+	h = hashlib.sha1()
+	with open(path, 'rb') as f:
+		for block in iter(lambda: f.read(1 << 20), ''):
+			h.update(block)
+	return h.hexdigest()
+
+class PredictionCache(object):
+	"""
+	PredictionCache(CachePath, Deploy, Weights, MaxEntries) -> PredictionCache
+
+	Predictions of one model, in an SQLite database that can hold those of
+	any number of models. When there are more than MaxEntries predictions
+	in all, the least recently used ones are dropped.
+	Hashing the weights takes a moment, so the hash is kept as well,
+	and only redone when the file's size or modification time changes.
+	"""
+	def __init__(self, cachepath, deploy, weights, max_entries=500000):
+		self.db = sqlite3.connect(cachepath)
+		self.db.execute('CREATE TABLE IF NOT EXISTS models (path TEXT PRIMARY KEY, '
+			'mtime REAL, size INTEGER, hash TEXT)')
+		self.db.execute('CREATE TABLE IF NOT EXISTS predictions (model TEXT, image TEXT, '
+			'prob BLOB, used REAL, PRIMARY KEY (model, image))')
+		self.db.execute('CREATE INDEX IF NOT EXISTS predictions_used ON predictions (used)')
+		h = hashlib.sha1()
+		for path in (deploy, weights):
+			h.update(self.file_hash(path))
+		self.model = h.hexdigest()
+		self.max_entries = max_entries
+		self.entries = self.db.execute('SELECT COUNT(*) FROM predictions').fetchone()[0]
+		self.trim()
+		self.db.commit()
+
+	def file_hash(self, path):
+		"""
+		file_hash(Path) -> hex digest, from the models table if the file is unchanged
+		"""
+		path = os.path.realpath(path)
+		st = os.stat(path)
+		row = self.db.execute('SELECT mtime, size, hash FROM models WHERE path = ?', (path,)).fetchone()
+		if row and row[0] == st.st_mtime and row[1] == st.st_size:
+			return str(row[2])
+		digest = hash_file(path)
+		self.db.execute('INSERT OR REPLACE INTO models VALUES (?, ?, ?, ?)',
+			(path, st.st_mtime, st.st_size, digest))
+		return digest
+
+	def get_many(self, hashes):
+		"""
+		get_many(ImageHashes) -> dict of ImageHash -> Probabilities for the ones cached
+		"""
+		found = {}
+		unique = list(set(hashes))
+		# stay under SQLite's limit on query parameters
+		for b in xrange(0, len(unique), 500):
+			chunk = unique[b:b+500]
+			marks = ','.join('?' * len(chunk))
+			for image, prob in self.db.execute('SELECT image, prob FROM predictions WHERE model = ? '
+					'AND image IN ('+marks+')', [self.model] + chunk):
+				found[str(image)] = np.frombuffer(str(prob), dtype=np.float32)
+			self.db.execute('UPDATE predictions SET used = ? WHERE model = ? AND image IN ('+marks+')',
+				[time.time(), self.model] + chunk)
+		self.db.commit()
+		return found
+
+	def put_many(self, predictions):
+		"""
+		put_many(list of (ImageHash, Probabilities)) -> None
+		"""
+		now = time.time()
+		for image, prob in predictions:
+			cur = self.db.execute('INSERT OR IGNORE INTO predictions VALUES (?, ?, ?, ?)',
+				(self.model, image, sqlite3.Binary(np.asarray(prob, dtype=np.float32).tostring()), now))
+			self.entries += cur.rowcount
+		self.trim()
+		self.db.commit()
+
+	def trim(self):
+		"""
+		trim() -> None
+		Drop the least recently used predictions over MaxEntries.
+		"""
+		if self.entries > self.max_entries:
+			self.db.execute('DELETE FROM predictions WHERE rowid IN '
+				'(SELECT rowid FROM predictions ORDER BY used LIMIT ?)', (self.entries - self.max_entries,))
+			self.entries = self.max_entries
+
+	def close(self):
+		self.db.close()
+
+def cached_batches(cache, classify, images, batch_size):
+	"""
+	cached_batches(Cache, Classify, Images, BatchSize) -> iterator of (Images, Probabilities)
+	Images are (path, label) pairs like classify.py's. They're all looked up
+	in the cache first, and only the ones that aren't there are passed to
+	Classify(images), which gives batches of (Images, Probabilities) in order.
+	Batches come out in the original order either way, and new
+	predictions are cached as they come.
+	"""
+	hashes = [hash_file(image[0]) for image in images]
+	cached = cache.get_many(hashes)
+	misses = [(image, h) for image, h in zip(images, hashes) if h not in cached]
+	def computed():
+		done = 0
+		for batch, probs in classify([image for image, h in misses]):
+			cache.put_many(zip([h for image, h in misses[done:done+len(batch)]], probs))
+			done += len(batch)
+			# caffe's probs are a view of its output blob, which the next
+			#    batch overwrites while this one's rows may still be waiting
+			for prob in np.array(probs):
+				yield prob
+	computed = computed()
+	for b in xrange(0, len(images), batch_size):
+		yield images[b:b+batch_size], np.array([cached[h] if h in cached else next(computed)
+			for h in hashes[b:b+batch_size]])
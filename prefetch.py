@@ -0,0 +1,90 @@
+#!/usr/bin/python
+# Prepares batches of input on background threads while the net runs
+# its forward pass on the previous batch
+import sys, threading, Queue
+from multiprocessing.pool import ThreadPool
+import numpy as np
+
+class BatchPrefetcher(object):
+	"""
+	BatchPrefetcher(Items, Preprocess, BatchSize, ItemShape, Workers, Buffers) -> BatchPrefetcher
+
+	Iterating gives (BatchItems, Buffer) pairs, where Buffer is one of a
+	few preallocated BatchSize x ItemShape arrays, filled in by calling
+	Preprocess(item, out) on a pool of worker threads, where out is
+	the item's slot in the buffer.
+
+	A buffer is handed back to be refilled when the next batch is asked
+	for, so copy it into the net (or finish with it) before then.
+	Up to Buffers - 1 batches are prepared ahead of the one in use.
+	Only the first len(BatchItems) rows of the last buffer are filled.
+	"""
+	def __init__(self, items, preprocess, batch_size, shape, workers=4, buffers=3, dtype=np.float32):
+		self.items = list(items)
+		self.preprocess = preprocess
+		self.batch_size = batch_size
+		self.pool = ThreadPool(workers)
+		self.free = Queue.Queue()
+		for _ in xrange(buffers):
+			self.free.put(np.empty((batch_size,) + tuple(shape), dtype=dtype))
+		self.ready = Queue.Queue()
+		self.thread = threading.Thread(target=self.produce)
+		self.thread.daemon = True
+		self.thread.start()
+
+	def produce(self):
+		"""
+		produce() -> None
+		Fill free buffers batch by batch until the items run out,
+		passing along the first exception instead if anything fails.
+		"""
+		try:
+			for b in xrange(0, len(self.items), self.batch_size):
+				batch = self.items[b:b+self.batch_size]
+				buf = self.free.get()
+				self.pool.map(lambda n: self.preprocess(batch[n], buf[n]), xrange(len(batch)))
+				self.ready.put((batch, buf))
+		except Exception:
+			self.ready.put(sys.exc_info())
+		self.ready.put(None)
+
+	def __iter__(self):
+		while True:
+			item = self.ready.get()
+			if item is None:
+				break
+			if len(item) == 3:
+				raise item[0], item[1], item[2]
+			batch, buf = item
+			yield batch, buf
+			self.free.put(buf)
+		self.pool.close()
+
+	def __len__(self):
+		return (len(self.items) + self.batch_size - 1) / self.batch_size
+
+def prefetched(items, load, ahead=4):
+	"""
+	prefetched(Items, Load, Ahead) -> iterator of (Item, Load(Item))
+	Load items one after another on a background thread, up to Ahead
+	of the one in use. For things that don't fit in a fixed-size
+	buffer, like whole images of different sizes.
+	"""
+	ready = Queue.Queue(ahead)
+	def produce():
+		try:
+			for item in items:
+				ready.put((item, load(item)))
+		except Exception:
+			ready.put(sys.exc_info())
+		ready.put(None)
+	thread = threading.Thread(target=produce)
+	thread.daemon = True
+	thread.start()
+	while True:
+		item = ready.get()
+		if item is None:
+			break
+		if len(item) == 3:
+			raise item[0], item[1], item[2]
+		yield item
@@ -3,103 +3,322 @@
 # 2016-07-13
 
 # Prepares the AFLW dataset for use with caffe
+# Every label set (face/non-face, pitch classes, ...) is built in a single pass,
+# so each image is read and each crop is encoded only once
 from PIL import Image
-import sys, os, random, time, datetime
+from cStringIO import StringIO
+import sys, os, random, time, datetime, argparse, itertools
+import numpy as np
+import aflw
+from multiprocessing import Pool
 
-def notface(c, nx, ny):
+resize = (227, 227)
+tdir=os.path.expanduser('~/aflw')
+odir=os.path.expanduser('~/caffe-model-project')
+fne = '.jpg' #imgpath[imgpath.index('.'):]
+splits = ('train', 'val')
+
+def split_name(i):
+	# every tenth face goes to the validation set
+	if i % 10 == 0:
+		return 'val'
+	return 'train'
+
+def emit(cropped_img, split, name, labels):
+	"""
+	emit(Image, Split, Name, Labels) -> (Split, Name, Labels, Array or None)
+	Labels is a list of (LabelSetIndex, Label) for every label set the crop
+	belongs to. The crop is encoded once and saved into the crop directory
+	of each of those sets, or with --lmdb, resized once and handed back
+	for the parent to write into the databases.
+	"""
+	if use_lmdb:
+		return (split, name, labels, crop_lmdb.to_caffe_array(cropped_img, resize))
+	buf = StringIO()
+	cropped_img.save(buf, format="JPEG")
+	for k, label in labels:
+		with open(odir+'/'+labelsets[k].cropdir(split)+'/'+aflw.shard_dir(name, shards)+name, 'wb') as f:
+			f.write(buf.getvalue())
+	return (split, name, labels, None)
+
+def notface(img, i, face, c, nx, ny, w, h, sets):
+	"""
+	notface(Image, RowIndex, FaceID, Suffix, X, Y, Width, Height, LabelSetIndices) -> Record
+	Crop a w*h patch at (nx, ny) that doesn't contain a face.
+	It goes into the given label sets as class 0.
+	"""
 	crop_rect = (nx, ny, w+nx, h+ny)
 	cropped_img = img.crop(crop_rect)
 	#cropped_img.thumbnail(resize, Image.ANTIALIAS)
-	if i % 10 == 0:
-		filename = odir + '/val/' + face + c + fne
-		val.write(filename+' 0\n')
-	else:
-		filename = odir + '/train/' + face + c + fne
-		train.write(filename+' 0\n')
-	cropped_img.save(filename, format="JPEG")
-	if i % 10 == 0:
-		sys.stdout.write('\033[33m'+filename+'\033[0m\n')
+	return emit(cropped_img, split_name(i), face + c + fne, [(k, 0) for k in sets])
+
+def read_journal(path, noutputs):
+	"""
+	read_journal(Path, OutputCount) -> (Settings, FaceIDs, Sizes, Length)
+	The journal starts with the settings of the build that a resumed build
+	has to reuse (seed and shard count), followed by batches of
+	face ids that were written, each closed by a checkpoint line holding
+	the sizes of the train and val outputs of every label set at that point.
+	Only faces in complete batches count as done; Length is the number of
+	bytes up to the last checkpoint, and anything after it is discarded.
+	"""
+	settings, done, pending, sizes, length = {}, set(), [], [0] * noutputs, 0
+	with open(path) as f:
+		pos = 0
+		for l in f:
+			pos += len(l)
+			if not l.endswith('\n'):
+				break
+			if l.startswith('seed ') or l.startswith('shards '):
+				key, value = l.split()
+				settings[key] = int(value)
+				length = pos
+			elif l.startswith('@ '):
+				done.update(pending)
+				pending = []
+				sizes = map(int, l.split()[1:])
+				length = pos
+			else:
+				pending.append(l.strip())
+	return settings, done, sizes, length
+
+def checkpoint(faces):
+	"""
+	checkpoint(FaceIDs) -> None
+	Make everything written so far durable, then record the faces as done.
+	For JPEG builds the sizes are the manifest lengths, for LMDB builds
+	they're the database entry counts.
+	"""
+	if use_lmdb:
+		for db in outputs:
+			db.commit()
+		sizes = [db.count for db in outputs]
 	else:
-		sys.stdout.write('\033[35m'+filename+'\033[0m\n')
+		for m in outputs:
+			m.flush()
+			os.fsync(m.fileno())
+		sizes = [m.tell() for m in outputs]
+	journal.write(''.join(face+'\n' for face in faces) + '@ ' + ' '.join(map(str, sizes)) + '\n')
+	journal.flush()
+	os.fsync(journal.fileno())
 
-resize = (227, 227)
-tdir=os.path.expanduser('~/aflw')
-odir=os.path.expanduser('~/caffe-model-project')
-#imgset = list(sys.argv[1]) # 0,2,3
-if len(sys.argv)>1:
-	offset = int(sys.argv[1])
-else:
-	offset = 0
-start = time.time()
-
-if os.path.isfile(odir+'/train.txt'):
-	os.remove(odir+'/train.txt')
-train=open(odir+'/train.txt','a')
-if os.path.isfile(odir+'/val.txt'):
-	os.remove(odir+'/val.txt')
-val=open(odir+'/val.txt','a')
-
-# frp.txt is a list of the images and their properties
-with open(tdir+'/frp.txt') as f:
-	lines=[l.split() for l in f.readlines()]
-	#lines=[l for l in lines if l[1][0] in imgset]
-	lenlines=len(lines)
-	for i in xrange(offset, lenlines):
+def process_group(group):
+	"""
+	process_group((ImagePath, RowIndices)) -> (ImagePath, list of (RowIndex, FaceID, Records) or None)
+	Decode one source image and crop, encode and save everything for
+	each of its frp.txt rows from that single decoded buffer.
+	The random margins for a row come from a generator seeded by the
+	row index, and the non-face samples from one seeded by the first row
+	of the image, so the output doesn't depend on which process handles it.
+	Records is a list of (Split, Name, Labels, Array) tuples from emit.
+	None is returned instead if the image couldn't be read.
+	"""
+	imgpath, rows = group
+	results = []
+	# the label sets that the non-face samples of this image go into
+	negsets = set()
+
+	try:
+		img = aflw.open_image(tdir+'/'+imgpath)
+	# a single image in the whole aflw dataset caused this error
+	except IOError:
+		return (imgpath, None)
+	width, height = img.size
+
+	for i in rows:
 		l=lines[i]
 		face=l[0] # face id
-		imgpath=l[1] # absolute path to image
+		# rows before the offset or in the journal have already been done
+		if i < offset or face in done:
+			continue
 		x=int(l[2]) # face rect x offset
 		y=int(l[3]) # face rect y offset
 		w=int(l[4]) # face rect width
 		h=int(l[5]) # face rect height
+		roll=float(l[6])
+		pitch=float(l[7])
+		yaw=float(l[8])
+		rng = random.Random((seed << 32) | i)
+		records = []
 
-		try:
-			img = Image.open(tdir+'/'+imgpath)
-			width, height = img.size
-			# shift the face rect by random margins
-			rx = x + random.randint(-w/4, w/4)
-			ry = y + random.randint(-h/4, h/4)
-			crop_rect = (rx, ry, w+rx, h+ry)
-			cropped_img = img.crop(crop_rect)
-			#cropped_img.thumbnail(resize, Image.ANTIALIAS)
-			fne = '.jpg' #imgpath[imgpath.index('.'):]
-
-			if i % 10 == 0:
-				filename = odir + '/val/' + face + fne
-				val.write(filename+' 1\n')
-			else:
-				filename = odir + '/train/' + face + fne
-				train.write(filename+' 1\n')
+		# the label sets this face belongs to, and its class in each
+		labels = [(k, ls.label(roll, pitch, yaw)) for k, ls in enumerate(labelsets)]
+		labels = [(k, label) for k, label in labels if label is not None]
+		if not labels:
+			results.append((i, face, records))
+			continue
 
-			cropped_img.save(filename, format="JPEG")
+		# shift the face rect by random margins
+		rx = x + rng.randint(-w/4, w/4)
+		ry = y + rng.randint(-h/4, h/4)
+		crop_rect = (rx, ry, w+rx, h+ry)
+		cropped_img = img.crop(crop_rect)
+		#cropped_img.thumbnail(resize, Image.ANTIALIAS)
+
+		records.append(emit(cropped_img, split_name(i), face + fne, labels))
+		negsets.update(k for k, label in labels)
+		results.append((i, face, records))
+
+	# get samples of parts of the image that aren't faces, kept clear of
+	#    every face in it, and file them under the first face done here
+	if negsets and nnegatives:
+		i, face, records = results[0]
+		gt = [map(int, lines[j][2:6]) for j in rows]
+		nrng = np.random.RandomState([seed, rows[0]])
+		boxes = aflw.sample_negatives(nrng, gt, width, height, nnegatives)
+		for n, (nx, ny, nw, nh) in enumerate(boxes):
+			records.append(notface(img, i, face, chr(ord('a')+n), nx, ny, nw, nh, sorted(negsets)))
+
+	return (imgpath, results)
+
+def parse_args():
+	"""Parse input arguments."""
+	parser = argparse.ArgumentParser(description='Prepare the AFLW crop datasets')
+	parser.add_argument('offset', nargs='?', default=0, type=int,
+						help='frp.txt row to start from [0]')
+	parser.add_argument('--workers', default=1, type=int,
+						help='Number of processes to decode/crop/encode with [1]')
+	parser.add_argument('--seed', default=None, type=int,
+						help='Seed for the random crop margins [random]')
+	parser.add_argument('--labels', default='face,pitch',
+						help='Comma-separated label sets to build, out of '
+						+ ', '.join(sorted(aflw.LABELSETS)) + ' [face,pitch]')
+	parser.add_argument('--lmdb', action='store_true',
+						help='Write resized crops straight into the LMDB databases '
+						'(train_lmdb, train-pitch-lmdb, ...) and compute the image means, '
+						'instead of writing JPEGs')
+	parser.add_argument('--negatives', default=2, type=int,
+						help='Number of non-face samples to take from each image, at most 26 [2]')
+	parser.add_argument('--shards', default=0, type=int,
+						help='Spread the crops over this many hash-named subdirectories '
+						'of each crop directory, each with its own manifest [0, no sharding]')
+	parser.add_argument('--resume', action='store_true',
+						help='Pick up an interrupted build from its checkpoint journal')
+	parser.add_argument('--checkpoint-every', dest='checkpoint_every', default=200, type=int,
+						help='Number of images between checkpoints [200]')
+	args = parser.parse_args()
+	# a non-face sample is named after the face with a letter on the end
+	if not 0 <= args.negatives <= 26:
+		parser.error('--negatives has to be from 0 to 26')
+	return args
+
+if __name__ == '__main__':
+	args = parse_args()
+	offset = args.offset
+	nnegatives = args.negatives
+	start = time.time()
+	labelsets = [aflw.LABELSETS[name] for name in args.labels.split(',')]
+	sys.stdout.write('Building \033[1;34m'+', '.join(ls.name for ls in labelsets)+'\033[0m\n')
+	# every label set has a train and a val output, the journal keeps their sizes in this order
+	targets = [(ls, split) for ls in labelsets for split in splits]
+	journalpath = odir+'/prepare_data.'+'-'.join(ls.name for ls in labelsets)+'.journal'
+
+	# a resumed build carries on from the last checkpoint in the journal
+	#    and appends to the outputs instead of starting them over
+	resume = args.resume and os.path.isfile(journalpath)
+	if resume:
+		settings, done, sizes, length = read_journal(journalpath, len(targets))
+		journal = open(journalpath, 'a')
+		journal.truncate(length)
+		sys.stdout.write('Resuming with \033[1;34m'+str(len(done))+'\033[0m faces already done\n')
+	else:
+		settings, done, sizes = {}, set(), [0] * len(targets)
+		journal = open(journalpath, 'w')
+
+	# pick a seed up front so any run can be reproduced, with or without --workers
+	if args.seed is not None:
+		seed = args.seed
+	else:
+		seed = settings.get('seed', random.randint(0, 2**31-1))
+	# the shard a crop goes into has to stay the same when resuming
+	shards = settings.get('shards', args.shards)
+	if not resume:
+		journal.write('seed %d\nshards %d\n' % (seed, shards))
+	sys.stdout.write('Using seed \033[1;34m'+str(seed)+'\033[0m\n')
+
+	use_lmdb = args.lmdb
+	if use_lmdb:
+		# only the parent writes to the databases, the workers just resize
+		import crop_lmdb
+		outputs = [crop_lmdb.CropLMDB(odir+'/'+ls.lmdb(split), odir+'/'+ls.mean(split),
+				resize, 0, sizes[k] if resume else None, seed)
+			for k, (ls, split) in enumerate(targets)]
+	else:
+		outputs = []
+		for k, (ls, split) in enumerate(targets):
+			manifest = odir+'/'+ls.manifest(split)
+			if not resume and os.path.isfile(manifest):
+				os.remove(manifest)
+			outputs.append(open(manifest,'a'))
+			# make the shard directories up front so the workers don't race to
+			for shard in aflw.shard_dirs(shards):
+				if not os.path.isdir(odir+'/'+ls.cropdir(split)+'/'+shard):
+					os.makedirs(odir+'/'+ls.cropdir(split)+'/'+shard)
+			# drop anything written after the last checkpoint, and move to the
+			#    new end, as tell() still gives the old one until the next write
+			outputs[-1].truncate(sizes[k])
+			outputs[-1].seek(0, 2)
+
+	# frp.txt is a list of the images and their properties
+	lines = aflw.read_frp(tdir+'/frp.txt')
+	#lines=[l for l in lines if l[1][0] in imgset]
+	lenlines=len(lines)
+	# rows are handed out one image at a time, so each image is decoded once
+	groups = [g for g in aflw.group_rows(lines) if g[1][-1] >= offset
+			and not all(lines[i][0] in done for i in g[1])]
+
+	# the workers are forked after lines and seed are set, so they inherit them
+	# imap hands the results back in row order, so the manifests come out
+	#    exactly as they would from a sequential run with the same seed
+	if args.workers > 1:
+		pool = Pool(args.workers)
+		results = pool.imap(process_group, groups, chunksize=4)
+	else:
+		pool = None
+		results = itertools.imap(process_group, groups)
+
+	finished = []
+	for n, (imgpath, faces) in enumerate(results):
+		if n and n % args.checkpoint_every == 0:
+			checkpoint(finished)
+			finished = []
+		if faces is None:
+			sys.stdout.write('\033[31m'+imgpath+'\033[0m\n')
+			continue
+		for i, face, records in faces:
+			finished.append(face)
 			sys.stdout.write(imgpath+' '+face+'\n')
-			if i % 10 == 0:
-				sys.stdout.write('\033[33m'+filename+'\033[0m\n')
-			else:
-				sys.stdout.write('\033[35m'+filename+'\033[0m\n')
-
-			# get samples of parts of images that aren't faces
-			# images with multiple faces are excluded for simplicity
-			# shift the face rect by random amounts and generate
-			#    up to two non-face images
-			if (0 < i < lenlines - 1) and lines[i-1][1] != imgpath and lines[i+1][1] != imgpath:
-				if w*3/2 < x:
-					notface('a', x - w*3/2, y + random.randint(-h/5, h/5))
-				elif w*3/2 < width-w-x:
-					notface('a', x + w*3/2, y + random.randint(-h/5, h/5))
-				if h*3/2 < y:
-					notface('b', x + random.randint(-w/5, w/5), y - h*3/2)
-				elif h*3/2 < height-h-y:
-					notface('b', x + random.randint(-w/5, w/5), y + h*3/2)
-
-		# a single image in the whole aflw dataset caused this error
-		except IOError:
-			sys.stdout.write('\033[31m'+imgpath+' '+face+'\033[0m\n')
-
-		te = (time.time() - start)
-		te_m, te_s = divmod(te, 60)
-		eta = int((te / (i-offset+1.0)) * (lenlines-1-i))
-		eta_m, eta_s = divmod(eta, 60)
-		# track time elapsed and estimated time remaining
-		sys.stdout.write('\033[36m'+str(i)+'\033[0m/\033[34m'+str(lenlines-1)+'\033[0m (\033[32m'+str(i * 100 / (lenlines-1))+'%\033[0m)\n')
-		sys.stdout.write('TE: '+str(int(te_m))+'m'+str(int(te_s))+'s  ETA: '+str(int(eta_m))+'m'+str(int(eta_s))+'s\n\n')
+			for split, name, labels, arr in records:
+				for k, label in labels:
+					output = outputs[2*k + splits.index(split)]
+					if use_lmdb:
+						filename = name
+						output.put(name, arr, label)
+					else:
+						filename = odir+'/'+labelsets[k].cropdir(split)+'/'+aflw.shard_dir(name, shards)+name
+						output.write(filename+' '+str(label)+'\n')
+					if split == 'val':
+						sys.stdout.write('\033[33m'+filename+'\033[0m\n')
+					else:
+						sys.stdout.write('\033[35m'+filename+'\033[0m\n')
+
+			te = (time.time() - start)
+			te_m, te_s = divmod(te, 60)
+			eta = int((te / (i-offset+1.0)) * (lenlines-1-i))
+			eta_m, eta_s = divmod(eta, 60)
+			# track time elapsed and estimated time remaining
+			sys.stdout.write('\033[36m'+str(i)+'\033[0m/\033[34m'+str(lenlines-1)+'\033[0m (\033[32m'+str(i * 100 / (lenlines-1))+'%\033[0m)\n')
+			sys.stdout.write('TE: '+str(int(te_m))+'m'+str(int(te_s))+'s  ETA: '+str(int(eta_m))+'m'+str(int(eta_s))+'s\n\n')
+
+	if pool:
+		pool.close()
+		pool.join()
+	checkpoint(finished)
+	journal.close()
+	for output in outputs:
+		output.close()
+
+	# split each manifest up by shard, so the shards can be read in parallel
+	if shards and not use_lmdb:
+		for ls, split in targets:
+			aflw.write_shard_manifests(odir+'/'+ls.manifest(split), shards)
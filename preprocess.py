@@ -0,0 +1,122 @@
+#!/usr/bin/python
+# Image loading, and a batch replacement for caffe.io.Transformer.preprocess
+# Run on its own, it checks the results against caffe's Transformer
+import sys, os
+import numpy as np
+from PIL import Image
+
+IMAGE_EXTS = ('.jpg', '.jpeg', '.png', '.bmp')
+
+def list_images(path, recursive=False):
+	"""
+	list_images(Path, Recursive) -> list of (ImagePath, Label or None)
+	A directory is listed for image files, along with everything under it
+	if Recursive, anything else is read as a train.txt/val.txt-style
+	manifest of "path label" lines.
+	"""
+	if os.path.isdir(path):
+		images = []
+		for root, dirs, files in os.walk(path):
+			dirs.sort()
+			images.extend((os.path.join(root, name), None) for name in sorted(files)
+						  if name.lower().endswith(IMAGE_EXTS))
+			if not recursive:
+				break
+		return images
+	images = []
+	with open(path) as f:
+		for l in f:
+			l = l.split()
+			if l:
+				images.append((os.path.expanduser(l[0]), int(l[1]) if len(l) > 1 else None))
+	return images
+
+def load_image(path):
+	"""
+	load_image(Path) -> H x W x 3 uint8 array
+	Like caffe.io.load_image, but without converting to floats in [0, 1].
+	Greyscale images get their channel repeated three times.
+	"""
+	return np.asarray(Image.open(path).convert('RGB'), dtype=np.uint8)
+
+def resize_batch(images, dims):
+	"""
+	resize_batch(Images, (Height, Width)) -> N x Height x Width x C float32 array
+	Bilinear resize of a whole batch at once. Pixels are sampled at their
+	centres, and anything outside an image counts as the image's minimum,
+	which is what caffe.io.resize_image gets out of skimage's order-1,
+	mode='constant' resize of the image scaled to [0, 1].
+	"""
+	n, h, w, c = images.shape
+	oh, ow = dims
+	# pad with a one-pixel border of each image's minimum
+	padded = np.empty((n, h+2, w+2, c), dtype=np.float32)
+	padded[...] = images.reshape(n, -1).min(axis=1)[:, np.newaxis, np.newaxis, np.newaxis]
+	padded[:, 1:-1, 1:-1] = images
+	def coords(insize, outsize):
+		x = (np.arange(outsize) + 0.5) * (float(insize) / outsize) - 0.5
+		x0 = np.floor(x)
+		# +1 for the border
+		return x0.astype(int) + 1, (x - x0).astype(np.float32)
+	y0, fy = coords(h, oh)
+	x0, fx = coords(w, ow)
+	top, bottom = padded[:, y0], padded[:, y0+1]
+	rows = top + (bottom - top) * fy[np.newaxis, :, np.newaxis, np.newaxis]
+	left, right = rows[:, :, x0], rows[:, :, x0+1]
+	return left + (right - left) * fx[np.newaxis, np.newaxis, :, np.newaxis]
+
+class BatchTransformer(object):
+	"""
+	BatchTransformer(InputShape, Mean, ChannelSwap, RawScale) -> BatchTransformer
+
+	Does the same as a caffe.io.Transformer with set_transpose((2,0,1)),
+	set_channel_swap(ChannelSwap), set_raw_scale(RawScale) and a
+	per-channel set_mean(Mean), for a whole batch at once.
+	InputShape is the N x C x H x W shape of the data blob.
+	Mean is in the net's channel order (after the swap), like Transformer's.
+	"""
+	def __init__(self, shape, mean, channel_swap=(2, 1, 0), raw_scale=255.0):
+		self.dims = tuple(shape[2:])
+		self.mean = np.asarray(mean, dtype=np.float32).reshape(-1)
+		self.channel_swap = channel_swap
+		# Transformer expects floats in [0, 1] from load_image, these are 0-255
+		self.scale = np.float32(raw_scale / 255.0)
+
+	def preprocess(self, images, out):
+		"""
+		preprocess(Images, Out) -> Out
+		Preprocess an N x H x W x 3 uint8 batch straight into the first N
+		rows of Out, usually the net's data blob.
+		The channel swap, transpose, scale and mean subtraction are done
+		channel by channel with strided reads, without intermediate copies.
+		Images that aren't the size of the blob are resized first.
+		"""
+		if images.shape[1:3] != self.dims:
+			images = resize_batch(images, self.dims)
+		n = images.shape[0]
+		for c, src in enumerate(self.channel_swap):
+			channel = out[:n, c]
+			if self.scale != 1:
+				np.multiply(images[..., src], self.scale, out=channel)
+				channel -= self.mean[c]
+			else:
+				np.subtract(images[..., src], self.mean[c], out=channel)
+		return out
+
+if __name__ == '__main__':
+	# compare with caffe's Transformer on the images given
+	import caffe
+	caffe_path = os.path.expanduser('~/caffe/')
+	mean = np.load(caffe_path+'python/caffe/imagenet/ilsvrc_2012_mean.npy').mean(1).mean(1)
+	shape = (1, 3, 227, 227)
+	transformer = caffe.io.Transformer({'data': shape})
+	transformer.set_mean('data', mean)
+	transformer.set_transpose('data', (2,0,1))
+	transformer.set_channel_swap('data', (2,1,0))
+	transformer.set_raw_scale('data', 255.0)
+	bt = BatchTransformer(shape, mean)
+	out = np.empty(shape, dtype=np.float32)
+	for path in sys.argv[1:]:
+		expected = transformer.preprocess('data', caffe.io.load_image(path))
+		bt.preprocess(load_image(path)[np.newaxis], out)
+		print '{:s}: max abs difference {:g}'.format(path, np.abs(out[0] - expected).max())
@@ -3,7 +3,7 @@
 
 import sys, os
 import numpy as np
-import caffe
+import prefetch, preprocess, backend, modelserver
 
 caffe_path = os.path.expanduser('~/caffe/')
 model_dir = caffe_path + 'myModel/'
@@ -11,43 +11,51 @@ model_name = sys.argv[1]
 if model_name[0] != '/':
 	model_name = model_dir + model_name
 if len(sys.argv) > 2:
-	image_path = sys.argv[2]
+	image_paths = sys.argv[2:]
 else:
-	image_path = raw_input('Enter image path: ').replace("'", "").strip()
-image_path = os.path.expanduser(image_path)
+	image_paths = [raw_input('Enter image path: ').replace("'", "").strip()]
+image_paths = [os.path.expanduser(image_path) for image_path in image_paths]
 
 
-#load the model
-net = caffe.Net(model_dir + 'deploy.prototxt',
-                model_name,
-                caffe.TEST)
+def show(batch, probs):
+	#predicted predicted class
+	for image_path, prob in zip(batch, probs):
+		if len(image_paths) > 1:
+			print image_path
+		print(prob)
+		print prob.argmax()
 
-# load input and configure preprocessing
-transformer = caffe.io.Transformer({'data': net.blobs['data'].data.shape})
-transformer.set_mean('data', np.load(caffe_path+'python/caffe/imagenet/ilsvrc_2012_mean.npy').mean(1).mean(1))
-transformer.set_transpose('data', (2,0,1))
-transformer.set_channel_swap('data', (2,1,0))
-transformer.set_raw_scale('data', 255.0)
+#if there's a model server running, it already has the model loaded
+client = modelserver.connect()
+if client:
+	show(image_paths, client.classify(model_dir + 'deploy.prototxt', model_name, image_paths))
+	sys.exit()
+
+#load the model and configure preprocessing
+net, transformer = backend.load_model(model_dir + 'deploy.prototxt', model_name)
 
 #note we can change the batch size on-the-fly
-#since we classify only one image, we change batch size from 10 to 1
-net.blobs['data'].reshape(1,3,227,227)
+#we classify up to 10 images at once, or just the one if that's all there is
+batch_size = min(len(image_paths), 10)
+net.blobs['data'].reshape(batch_size,3,227,227)
+
+#load the images on background threads, so the next batch is
+#ready by the time the net is done with the current one
+def load(image_path, out):
+	transformer.preprocess(preprocess.load_image(image_path)[np.newaxis], out[np.newaxis])
 
-#load the image in the data layer
-im = caffe.io.load_image(image_path)
-net.blobs['data'].data[...] = transformer.preprocess('data', im)
+for batch, data in prefetch.BatchPrefetcher(image_paths, load, batch_size, (3,227,227)):
+	#load the images in the data layer
+	net.blobs['data'].data[...] = data
 
-#compute
-out = net.forward()
+	#compute
+	out = net.forward()
 
-# other possibility : out = net.forward_all(data=np.asarray([transformer.preprocess('data', im)]))
+	# other possibility : out = net.forward_all(data=np.asarray([transformer.preprocess('data', im)]))
 
-#predicted predicted class
-print(out['prob'][0])
-print out['prob'].argmax()
+	show(batch, out['prob'])
 
 #print predicted labels
 #labels = np.loadtxt(caffe_path+"data/ilsvrc12/synset_words.txt", str, delimiter='\t')
 #top_k = net.blobs['prob'].data[0].flatten().argsort()[-1:-6:-1]
 #print labels[top_k]
-
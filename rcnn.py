@@ -0,0 +1,102 @@
+#!/usr/bin/python
+# The trained Faster R-CNN face detector and how detections are made with
+# it, shared by run-rcnn.py and evaluate.py so they load the same net and
+# take the same detection options.
+import sys, os
+sys.path.append(os.path.expanduser('~/py-faster-rcnn/tools'))
+import _init_paths
+from fast_rcnn.config import cfg
+from fast_rcnn.test import im_detect
+import numpy as np
+import caffe
+import detpost, tiling
+
+#CLASSES = ('__background__',
+#		   'aeroplane', 'bicycle', 'bird', 'boat',
+#		   'bottle', 'bus', 'car', 'cat', 'chair',
+#		   'cow', 'diningtable', 'dog', 'horse',
+#		   'motorbike', 'person', 'pottedplant',
+#		   'sheep', 'sofa', 'train', 'tvmonitor')
+CLASSES = ('__background__', 'face')
+
+PROTOTXT = os.path.expanduser('~/caffe-model-project/deploy-rcnn.pt')
+CAFFEMODEL = os.path.expanduser('~/py-faster-rcnn/output/default/train/vgg_cnn_m_1024_rpn_stage1_iter_20000.caffemodel')
+
+def add_args(parser):
+	"""
+	add_args(ArgumentParser) -> None
+	The options for loading the net and for detector().
+	"""
+	parser.add_argument('--gpu', dest='gpu_id', help='GPU device id to use [0]',
+						default=0, type=int)
+	parser.add_argument('--cpu', dest='cpu_mode',
+						help='Use CPU mode (overrides --gpu)',
+						action='store_true')
+	parser.add_argument('--thresh', default=0.05, type=float,
+						help='Lowest score to keep [0.05]')
+	parser.add_argument('--nms', default=0.3, type=float,
+						help='Per-class NMS overlap threshold [0.3]')
+	parser.add_argument('--soft-nms', dest='soft_nms', choices=('linear', 'gaussian'),
+						help='Decay overlapping scores instead of dropping the boxes')
+	parser.add_argument('--sigma', default=0.5, type=float,
+						help='Gaussian soft-NMS sigma [0.5]')
+	parser.add_argument('--top-k', dest='top_k', type=int,
+						help='Most detections to keep per image, over all classes')
+	parser.add_argument('--tile', default=0, type=int,
+						help='Detect in overlapping tiles of this many pixels square')
+	parser.add_argument('--tile-overlap', dest='tile_overlap', default=100, type=int,
+						help='Pixels tiles overlap by, at least the biggest face at each scale [100]')
+	parser.add_argument('--scales', default='1',
+						help='Comma-separated scales of the image to tile, e.g. 0.5,1,2 [1]')
+
+def check_args(parser, args):
+	"""
+	check_args(ArgumentParser, Args) -> None
+	Exit with the usage if the options from add_args don't go together.
+	"""
+	if args.tile and not 0 <= args.tile_overlap < args.tile:
+		parser.error('--tile-overlap has to be at least 0 and less than --tile')
+
+def load_net(args, prototxt=PROTOTXT, caffemodel=CAFFEMODEL):
+	"""
+	load_net(Args, Prototxt, CaffeModel) -> Net, on the device Args asks for
+	and warmed up, so the first image isn't timed with the setup.
+	"""
+	cfg.TEST.HAS_RPN = True  # Use RPN for proposals
+	if not os.path.isfile(caffemodel):
+		raise IOError(('{:s} not found.\nDid you run ./data/script/'
+					   'fetch_faster_rcnn_models.sh?').format(caffemodel))
+
+	if args.cpu_mode:
+		caffe.set_mode_cpu()
+	else:
+		caffe.set_mode_gpu()
+		caffe.set_device(args.gpu_id)
+		cfg.GPU_ID = args.gpu_id
+	net = caffe.Net(prototxt, caffemodel, caffe.TEST)
+
+	print '\n\nLoaded network {:s}'.format(caffemodel)
+
+	# Warmup on a dummy image
+	im = 128 * np.ones((300, 500, 3), dtype=np.uint8)
+	for i in xrange(2):
+		_, _= im_detect(net, im)
+	return net
+
+def detector(args):
+	"""
+	detector(Args) -> Detect(Net, Image), giving the N x 5 detections of
+	each class but the background like detpost.postprocess, tiled if
+	Args asks for it
+	"""
+	if args.tile:
+		scales = [float(s) for s in args.scales.split(',')]
+		def detect(net, im):
+			return tiling.detect_tiled(net, tiling.Pyramid(im), scales, args.tile, args.tile_overlap,
+				thresh=args.thresh, nms_thresh=args.nms, soft=args.soft_nms, sigma=args.sigma, top_k=args.top_k)
+	else:
+		def detect(net, im):
+			scores, boxes = im_detect(net, im)
+			return detpost.postprocess(scores, boxes, args.thresh, args.nms,
+				args.soft_nms, args.sigma, args.top_k)
+	return detect
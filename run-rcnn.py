@@ -13,28 +13,20 @@ Demo script showing detections in sample images.
 See README.md for installation instructions before running.
 """
 
-import sys, os
+import sys, os, json
 sys.path.append(os.path.expanduser('~/py-faster-rcnn/tools'))
 import _init_paths
 from fast_rcnn.config import cfg
 from fast_rcnn.test import im_detect
-from fast_rcnn.nms_wrapper import nms
 from utils.timer import Timer
-import matplotlib.pyplot as plt
 import numpy as np
 import scipy.io as sio
-import caffe, cv2
+import cv2
 import argparse
+import prefetch, detpost, preprocess, rcnn
+from rcnn import CLASSES
 
 
-#CLASSES = ('__background__',
-#		   'aeroplane', 'bicycle', 'bird', 'boat',
-#		   'bottle', 'bus', 'car', 'cat', 'chair',
-#		   'cow', 'diningtable', 'dog', 'horse',
-#		   'motorbike', 'person', 'pottedplant',
-#		   'sheep', 'sofa', 'train', 'tvmonitor')
-CLASSES = ('__background__', 'face')
-
 NETS = {'vgg16': ('VGG16',
 				  'VGG16_faster_rcnn_final.caffemodel'),
 		'zf': ('ZF',
@@ -43,6 +35,8 @@ NETS = {'vgg16': ('VGG16',
 
 def vis_detections(im, class_name, dets, thresh=0.5):
 	"""Draw detected bounding boxes."""
+	# only imported for the demo, so batch mode runs without a display
+	import matplotlib.pyplot as plt
 	inds = np.where(dets[:, -1] >= thresh)[0]
 	if len(inds) == 0:
 		return
@@ -91,34 +85,72 @@ def demo(net, image_name):
 	# Visualize detections for each class
 	CONF_THRESH = 0.8
 	NMS_THRESH = 0.3
-	for cls_ind, cls in enumerate(CLASSES[1:]):
-		cls_ind += 1 # because we skipped background
-		cls_boxes = boxes[:, 4*cls_ind:4*(cls_ind + 1)]
-		cls_scores = scores[:, cls_ind]
-		dets = np.hstack((cls_boxes,
-						  cls_scores[:, np.newaxis])).astype(np.float32)
-		keep = nms(dets, NMS_THRESH)
-		dets = dets[keep, :]
+	# thresholding before NMS keeps the same boxes, as only a higher
+	# scoring box can suppress one
+	for cls, dets in zip(CLASSES[1:], detpost.postprocess(scores, boxes, CONF_THRESH, NMS_THRESH)):
 		vis_detections(im, cls, dets, thresh=CONF_THRESH)
 
+def detect_all(net, images, output, detect):
+	"""
+	detect_all(Net, ImagePaths, OutputPath, Detect) -> None
+	Run Detect(Net, Image), which gives the N x 5 detections of each class
+	like detpost.postprocess, over every image, loading the next ones on a background
+	thread meanwhile, and save the detections without plotting anything.
+	A .jsonl output gets a line per image, {"image", "time", "detections":
+	{class: [[x1, y1, x2, y2, score], ...]}}; an .npz gets the arrays
+	images, and image_index, classes, boxes and scores with a row per detection.
+	"""
+	jsonl = output.endswith('.jsonl')
+	out = open(output, 'w') if jsonl else None
+	image_index, classes, boxes_out, scores_out = [], [], [], []
+	timer = Timer()
+	done = 0
+	for i, (im_file, im) in enumerate(prefetch.prefetched(images, cv2.imread)):
+		if im is None:
+			print '\nCould not read {:s}'.format(im_file)
+			continue
+		timer.tic()
+		all_dets = detect(net, im)
+		timer.toc()
+		if jsonl:
+			out.write(json.dumps({'image': im_file, 'time': timer.diff, 'detections':
+				dict((cls, dets.tolist()) for cls, dets in zip(CLASSES[1:], all_dets))})+'\n')
+		else:
+			for cls_ind, dets in enumerate(all_dets):
+				image_index.extend([i] * len(dets))
+				classes.extend([cls_ind + 1] * len(dets))
+				boxes_out.append(dets[:, :4])
+				scores_out.append(dets[:, 4])
+		done += 1
+		sys.stdout.write('\r{:d} / {:d} images, {:.3f}s per image'.format(i + 1, len(images), timer.average_time))
+		sys.stdout.flush()
+	sys.stdout.write('\n')
+	if jsonl:
+		out.close()
+	else:
+		np.savez_compressed(output, images=np.array(images), classes=np.array(CLASSES),
+			image_index=np.array(image_index, dtype=np.int32), class_index=np.array(classes, dtype=np.int32),
+			boxes=np.vstack(boxes_out) if boxes_out else np.zeros((0, 4), np.float32),
+			scores=np.hstack(scores_out) if scores_out else np.zeros(0, np.float32))
+	print 'Detected in {:d} images, {:.1f} images/s'.format(done, done / max(timer.total_time, 1e-9))
+
 def parse_args():
 	"""Parse input arguments."""
 	parser = argparse.ArgumentParser(description='Faster R-CNN demo')
-	parser.add_argument('--gpu', dest='gpu_id', help='GPU device id to use [0]',
-						default=0, type=int)
-	parser.add_argument('--cpu', dest='cpu_mode',
-						help='Use CPU mode (overrides --gpu)',
-						action='store_true')
+	rcnn.add_args(parser)
 	parser.add_argument('--net', dest='demo_net', help='Network to use [vgg16]',
 						choices=NETS.keys(), default='vgg16')
+	parser.add_argument('--input', help='Directory (searched recursively) or list of images '
+						'to detect in, headless, instead of the demo images')
+	parser.add_argument('--output', default='detections.npz',
+						help='Where to save --input detections, .npz or .jsonl [detections.npz]')
 
 	args = parser.parse_args()
+	rcnn.check_args(parser, args)
 
 	return args
 
 if __name__ == '__main__':
-	cfg.TEST.HAS_RPN = True  # Use RPN for proposals
-
 	args = parse_args()
 
 	#prototxt = os.path.join(cfg.MODELS_DIR, NETS[args.demo_net][0],
@@ -126,29 +158,13 @@ if __name__ == '__main__':
 	#caffemodel = os.path.join(cfg.DATA_DIR, 'faster_rcnn_models',
 	#						  NETS[args.demo_net][1])
 
-	prototxt = os.path.expanduser('~/caffe-model-project/deploy-rcnn.pt')
-	caffemodel = os.path.expanduser('~/py-faster-rcnn/output/default/train/vgg_cnn_m_1024_rpn_stage1_iter_20000.caffemodel')
-
-	if not os.path.isfile(caffemodel):
-		raise IOError(('{:s} not found.\nDid you run ./data/script/'
-					   'fetch_faster_rcnn_models.sh?').format(caffemodel))
-
-	if args.cpu_mode:
-		caffe.set_mode_cpu()
-	else:
-		caffe.set_mode_gpu()
-		caffe.set_device(args.gpu_id)
-		cfg.GPU_ID = args.gpu_id
-	net = caffe.Net(prototxt, caffemodel, caffe.TEST)
-
-	print '\n\nLoaded network {:s}'.format(caffemodel)
-
-	# Warmup on a dummy image
-	im = 128 * np.ones((300, 500, 3), dtype=np.uint8)
-	for i in xrange(2):
-		_, _= im_detect(net, im)
-
+	net = rcnn.load_net(args)
 
+	if args.input:
+		# everything under a directory, or the images of a train.txt-style list
+		images = [path for path, label in preprocess.list_images(os.path.expanduser(args.input), recursive=True)]
+		detect_all(net, images, args.output, rcnn.detector(args))
+		sys.exit()
 
 	im_names = ['000456.jpg', '000542.jpg', '001150.jpg',
 				'001763.jpg', '004545.jpg']
@@ -157,4 +173,5 @@ if __name__ == '__main__':
 		print 'Demo for data/demo/{}'.format(im_name)
 		demo(net, im_name)
 
+	import matplotlib.pyplot as plt
 	plt.show()
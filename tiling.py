@@ -0,0 +1,132 @@
+#!/usr/bin/python
+# Tiled, multi-scale Faster R-CNN detection for large crowd images.
+# im_detect shrinks a whole photo to 600 pixels on its short side, which
+# leaves the faces at the back of a crowd a few pixels wide. Instead each
+# scale of the image is cut into overlapping tiles that im_detect takes
+# as they are, so the net only ever sees a tile's worth of pixels and
+# the time per image only depends on its size, and the detections of
+# every tile at every scale are merged with one NMS.
+import sys, os
+sys.path.append(os.path.expanduser('~/py-faster-rcnn/tools'))
+import _init_paths
+from fast_rcnn.config import cfg
+from fast_rcnn.test import im_detect
+import numpy as np
+import cv2
+import detpost
+
+class Pyramid(object):
+	"""
+	Pyramid(Image, MaxPixels) -> Pyramid
+
+	An image at any number of scales, each resized once and kept, so every
+	pass over a scale (every tile, or another run over the same image)
+	reuses it. A level is resized from the smallest one already kept that's
+	at least as big, which costs less than starting from the full image.
+	Levels of more than MaxPixels aren't kept; their tiles are resized from
+	just the part of the image under them, so memory stays bounded.
+	"""
+	def __init__(self, im, max_pixels=16000000):
+		self.height, self.width = im.shape[:2]
+		self.max_pixels = max_pixels
+		self.levels = {1.0: im}
+
+	def shape(self, scale):
+		"""
+		shape(Scale) -> (height, width) of the image at Scale
+		"""
+		return int(round(self.height * scale)), int(round(self.width * scale))
+
+	def level(self, scale):
+		"""
+		level(Scale) -> the whole image at Scale
+		"""
+		if scale not in self.levels:
+			larger = [s for s in self.levels if s >= scale]
+			src = self.levels[min(larger) if larger else 1.0]
+			h, w = self.shape(scale)
+			self.levels[scale] = cv2.resize(src, (w, h), interpolation=cv2.INTER_AREA
+				if h < src.shape[0] else cv2.INTER_LINEAR)
+		return self.levels[scale]
+
+	def tile(self, scale, x, y, w, h):
+		"""
+		tile(Scale, X, Y, Width, Height) -> that part of the image at Scale
+		"""
+		sh, sw = self.shape(scale)
+		if scale in self.levels or sh * sw <= self.max_pixels:
+			return self.level(scale)[y:y+h, x:x+w]
+		# too big to keep, resize only the part of the full image under the tile
+		x0, y0 = int(x / scale), int(y / scale)
+		x1 = min(int(np.ceil((x + w) / scale)) + 1, self.width)
+		y1 = min(int(np.ceil((y + h) / scale)) + 1, self.height)
+		part = cv2.resize(self.levels[1.0][y0:y1, x0:x1],
+			(int(round((x1 - x0) * scale)), int(round((y1 - y0) * scale))), interpolation=cv2.INTER_LINEAR)
+		ox, oy = int(round(x - x0 * scale)), int(round(y - y0 * scale))
+		return part[oy:oy+h, ox:ox+w]
+
+def tile_starts(length, size, overlap):
+	"""
+	tile_starts(Length, Size, Overlap) -> where each tile starts along one side
+	Tiles of Size overlapping by at least Overlap, the last one flush with
+	the end; a single tile if Length fits in one.
+	"""
+	if not 0 <= overlap < size:
+		raise ValueError('Tiles of {:d} pixels can\'t overlap by {:d}'.format(size, overlap))
+	if length <= size:
+		return [0]
+	return range(0, length - size, size - overlap) + [length - size]
+
+def tiles(pyramid, scales, size, overlap):
+	"""
+	tiles(Pyramid, Scales, Size, Overlap) -> list of (scale, x, y, w, h)
+	Every tile of every scale, in that scale's pixels.
+	"""
+	out = []
+	for scale in scales:
+		h, w = pyramid.shape(scale)
+		for y in tile_starts(h, size, overlap):
+			for x in tile_starts(w, size, overlap):
+				out.append((scale, x, y, min(size, w), min(size, h)))
+	return out
+
+def detect_tiled(net, pyramid, scales, size=600, overlap=100, seam=4, thresh=0.05, nms_thresh=0.3,
+				 soft=None, sigma=0.5, top_k=None):
+	"""
+	detect_tiled(Net, Pyramid, Scales, Size, Overlap, Seam, Thresh, NMSThresh, Soft, Sigma, TopK) -> list of N x 5 arrays
+	The (x1, y1, x2, y2, score) detections of each class but the background
+	in the full image, from im_detect over Size x Size tiles of each of
+	Scales. Boxes within Seam pixels of a side of the tile that isn't the
+	image's own are dropped, as they're cut off and the neighbouring tile
+	has them whole, provided Overlap is at least as big as the faces at that
+	scale (smaller scales find the bigger ones). What's left of every tile is
+	merged by detpost.postprocess, with the other arguments.
+	"""
+	all_scores, all_boxes = [], []
+	saved = cfg.TEST.SCALES, cfg.TEST.MAX_SIZE
+	try:
+		for scale, x, y, w, h in tiles(pyramid, scales, size, overlap):
+			im = pyramid.tile(scale, x, y, w, h)
+			th, tw = im.shape[:2]
+			# so im_detect takes the tile at its own size
+			cfg.TEST.SCALES = (min(th, tw),)
+			cfg.TEST.MAX_SIZE = max(th, tw)
+			scores, boxes = im_detect(net, im)
+			sh, sw = pyramid.shape(scale)
+			b = boxes.reshape(len(boxes), scores.shape[1], 4)
+			cut = np.zeros(b.shape[:2], dtype=bool)
+			if x > 0:
+				cut |= b[:, :, 0] < seam
+			if y > 0:
+				cut |= b[:, :, 1] < seam
+			if x + tw < sw:
+				cut |= b[:, :, 2] >= tw - 1 - seam
+			if y + th < sh:
+				cut |= b[:, :, 3] >= th - 1 - seam
+			scores = np.where(cut, 0, scores)
+			all_scores.append(scores)
+			all_boxes.append(((b + [x, y, x, y]) / scale).reshape(boxes.shape))
+	finally:
+		cfg.TEST.SCALES, cfg.TEST.MAX_SIZE = saved
+	return detpost.postprocess(np.vstack(all_scores), np.vstack(all_boxes).astype(np.float32),
+		thresh, nms_thresh, soft, sigma, top_k)
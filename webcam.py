@@ -1,35 +1,386 @@
 import cv2
-import sys
+import sys, os, time, json, threading, argparse
+import numpy as np
+import preprocess
 
-cascPath = sys.argv[1]
-faceCascade = cv2.CascadeClassifier(cascPath)
+class Latest(object):
+	"""
+	Latest() -> Latest
+	Holds only the newest of whatever is put in it, with a sequence number,
+	so a slow reader skips straight to the newest instead of falling behind.
+	"""
+	def __init__(self):
+		self.cond = threading.Condition()
+		self.seq = 0
+		self.item = None
 
-video_capture = cv2.VideoCapture(0)
+	def put(self, item):
+		with self.cond:
+			self.seq += 1
+			self.item = item
+			self.cond.notify_all()
 
-while True:
-	# Capture frame-by-frame
-	ret, frame = video_capture.read()
-	print frame.shape
-	gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+	def get(self, after=0, timeout=None):
+		"""
+		get(After, Timeout) -> (Seq, Item)
+		Wait for something newer than sequence number After.
+		Gives (After, None) if there's nothing new within Timeout seconds.
+		"""
+		with self.cond:
+			if self.seq <= after:
+				self.cond.wait(timeout)
+			if self.seq <= after:
+				return after, None
+			return self.seq, self.item
 
-	faces = faceCascade.detectMultiScale(
-		gray,
+class RateCounter(object):
+	"""
+	RateCounter() -> RateCounter
+	Counts events per second, and averages a value (like a latency)
+	over the same events, in windows of about a second.
+	"""
+	def __init__(self):
+		self.lock = threading.Lock()
+		self.start = time.time()
+		self.count = 0
+		self.total = 0.0
+		self.rate = 0.0
+		self.mean = 0.0
+
+	def tick(self, value=0.0):
+		with self.lock:
+			self.count += 1
+			self.total += value
+			now = time.time()
+			if now - self.start >= 1.0:
+				self.rate = self.count / (now - self.start)
+				self.mean = self.total / self.count
+				self.start, self.count, self.total = now, 0, 0.0
+
+def detect_faces(faceCascade, gray, **kwargs):
+	"""
+	detect_faces(Cascade, GreyImage, **DetectArgs) -> list of (x, y, w, h)
+	"""
+	params = dict(
 		scaleFactor=1.1,
 		minNeighbors=5,
 		minSize=(30, 30),
 		#flags=cv2.CV_HAAR_SCALE_IMAGE
 	)
+	params.update(kwargs)
+	return [tuple(int(v) for v in f) for f in faceCascade.detectMultiScale(gray, **params)]
+
+def iou(a, b):
+	"""
+	iou((x, y, w, h), (x, y, w, h)) -> intersection over union
+	"""
+	iw = min(a[0]+a[2], b[0]+b[2]) - max(a[0], b[0])
+	ih = min(a[1]+a[3], b[1]+b[3]) - max(a[1], b[1])
+	if iw <= 0 or ih <= 0:
+		return 0.0
+	inter = float(iw * ih)
+	return inter / (a[2]*a[3] + b[2]*b[3] - inter)
+
+class FaceTracker(object):
+	"""
+	FaceTracker(Cascade, FullEvery, Margin) -> FaceTracker
+
+	Track-then-detect: the whole frame is only searched every FullEvery
+	frames, or on the frame after a tracked face is lost. In between, each
+	face is looked for only near where it should be by now, moving at the
+	same speed as since it was last found, in a region Margin times its
+	size bigger on each side, and only at scales close to its own.
+	"""
+	def __init__(self, faceCascade, full_every=10, margin=0.5):
+		self.faceCascade = faceCascade
+		self.full_every = full_every
+		self.margin = margin
+		# each track is [box, velocity], as float arrays
+		self.tracks = []
+		self.since_full = None
+		self.lost = False
+		self.full = 0
+		self.frames = 0
+
+	def update(self, gray):
+		"""
+		update(GreyImage) -> list of (x, y, w, h)
+		"""
+		self.frames += 1
+		if self.since_full is None or self.since_full + 1 >= self.full_every or self.lost:
+			self.detect_full(gray)
+		else:
+			self.since_full += 1
+			self.follow(gray)
+		return [tuple(int(round(v)) for v in box) for box, velocity in self.tracks]
+
+	def detect_full(self, gray):
+		"""
+		detect_full(GreyImage) -> None
+		Start the tracks over from a whole-frame detection, keeping the
+		velocity of any face that overlaps one that was being tracked.
+		"""
+		self.full += 1
+		self.since_full = 0
+		self.lost = False
+		tracks = []
+		for face in detect_faces(self.faceCascade, gray):
+			box = np.array(face, dtype=np.float32)
+			velocity = np.zeros(2, dtype=np.float32)
+			if self.tracks:
+				overlaps = [iou(face, old) for old, v in self.tracks]
+				best = int(np.argmax(overlaps))
+				if overlaps[best] > 0.3:
+					velocity = box[:2] - self.tracks[best][0][:2]
+			tracks.append([box, velocity])
+		self.tracks = tracks
+
+	def follow(self, gray):
+		"""
+		follow(GreyImage) -> None
+		Search for each face around its predicted position.
+		A face that isn't found keeps its predicted box for this
+		frame, and the next frame gets a full detection.
+		"""
+		height, width = gray.shape[:2]
+		tracks = []
+		for box, velocity in self.tracks:
+			predicted = box.copy()
+			predicted[:2] += velocity
+			x, y, w, h = predicted
+			x0, y0 = int(max(0, x - self.margin*w)), int(max(0, y - self.margin*h))
+			x1, y1 = int(min(width, x + w + self.margin*w)), int(min(height, y + h + self.margin*h))
+			found = []
+			if x1 - x0 >= w and y1 - y0 >= h:
+				found = detect_faces(self.faceCascade, gray[y0:y1, x0:x1],
+					minSize=(int(w*0.7), int(h*0.7)), maxSize=(int(w*1.5)+1, int(h*1.5)+1))
+			if not found:
+				self.lost = True
+				tracks.append([predicted, velocity])
+				continue
+			# the one closest to where the face should be
+			centre = predicted[:2] + predicted[2:] / 2
+			fx, fy, fw, fh = min(found, key=lambda f: np.hypot(x0 + f[0] + f[2]/2.0 - centre[0],
+				y0 + f[1] + f[3]/2.0 - centre[1]))
+			new = np.array((x0 + fx, y0 + fy, fw, fh), dtype=np.float32)
+			tracks.append([new, new[:2] - box[:2]])
+		# two tracks that ended up on the same face
+		self.tracks = []
+		for t in tracks:
+			if all(iou(t[0], kept[0]) < 0.5 for kept in self.tracks):
+				self.tracks.append(t)
+
+def capture(video_capture, frames, counter, stop):
+	"""
+	capture(VideoCapture, Frames, Counter, StopEvent) -> None
+	Read frames as fast as the camera gives them, so none queue up in the
+	driver, keeping just the newest as (frame, capture time).
+	"""
+	while not stop.is_set():
+		ret, frame = video_capture.read()
+		if not ret:
+			break
+		frames.put((frame, time.time()))
+		counter.tick()
+	stop.set()
+
+def detect(find_faces, frames, detections, counter, stop, out=None):
+	"""
+	detect(FindFaces, Frames, Detections, Counter, StopEvent, OutFile) -> None
+	Run FindFaces(gray) on the newest frame each time it's done with one,
+	keeping the newest result as (faces, capture time of its frame),
+	and writing it to OutFile as a JSON line if there is one.
+	"""
+	seq = 0
+	while not stop.is_set():
+		seq, item = frames.get(seq, timeout=0.1)
+		if item is None:
+			continue
+		frame, captured = item
+		gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+		faces = find_faces(gray)
+		detections.put((faces, captured))
+		if out:
+			out.write(json.dumps({'frame': seq, 'time': captured, 'faces': faces})+'\n')
+		# latency from the frame being captured to its faces being found
+		counter.tick(time.time() - captured)
+
+class ImageSequence(object):
+	"""
+	ImageSequence(Directory) -> ImageSequence
+	The images in a directory, in filename order, read like a video.
+	"""
+	def __init__(self, path):
+		self.paths = [p for p, label in preprocess.list_images(path)]
+		self.next = 0
+
+	def read(self):
+		while self.next < len(self.paths):
+			frame = cv2.imread(self.paths[self.next])
+			self.next += 1
+			if frame is not None:
+				return True, frame
+		return False, None
+
+	def name(self):
+		return self.paths[self.next - 1]
+
+	def release(self):
+		pass
+
+def run_live(video_capture, find_faces, out, show):
+	"""
+	run_live(VideoCapture, FindFaces, OutFile, Show) -> None
+	Capture, detect and display on their own threads, detecting on the
+	newest frame whenever the last detection is done, until q is pressed
+	(or Ctrl-C when not showing the video).
+	"""
+	frames, detections = Latest(), Latest()
+	captured, detected, displayed = RateCounter(), RateCounter(), RateCounter()
+	stop = threading.Event()
+	threads = [threading.Thread(target=capture, args=(video_capture, frames, captured, stop)),
+		threading.Thread(target=detect, args=(find_faces, frames, detections, detected, stop, out))]
+	for t in threads:
+		t.daemon = True
+		t.start()
+
+	seq = 0
+	faces = ()
+	last_print = time.time()
+	try:
+		while not stop.is_set():
+			# Wait for the next frame, but keep the window responsive regardless
+			seq, item = frames.get(seq, timeout=0.1)
+			if item is not None and show:
+				frame = item[0].copy()
+				# Draw a rectangle around the most recently detected faces
+				latest = detections.item
+				if latest is not None:
+					faces = latest[0]
+				for (x, y, w, h) in faces:
+					cv2.rectangle(frame, (x, y), (x+w, y+h), (0, 255, 0), 2)
+
+				# Display the resulting frame
+				cv2.imshow('Video', frame)
+				displayed.tick()
+
+			if time.time() - last_print >= 1.0:
+				last_print = time.time()
+				sys.stdout.write('\rcapture {:5.1f} fps, detection {:5.1f} fps, display {:5.1f} fps, detection latency {:6.1f} ms'.format(
+					captured.rate, detected.rate, displayed.rate, detected.mean * 1000))
+				sys.stdout.flush()
+
+			if show and cv2.waitKey(1) & 0xFF == ord('q'):
+				break
+	except KeyboardInterrupt:
+		pass
+
+	stop.set()
+	for t in threads:
+		t.join(1.0)
+	sys.stdout.write('\n')
+
+def run_offline(source, find_faces, out, show):
+	"""
+	run_offline(Source, FindFaces, OutFile, Show) -> None
+	Detect on every frame of a video file or image directory in turn,
+	timing each stage, so runs on the same footage can be compared.
+	"""
+	stages = ('decode', 'gray', 'detect')
+	times = dict((stage, []) for stage in stages)
+	start = time.time()
+	n = 0
+	while True:
+		t0 = time.time()
+		ret, frame = source.read()
+		t1 = time.time()
+		if not ret:
+			break
+		gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+		t2 = time.time()
+		faces = find_faces(gray)
+		t3 = time.time()
+		for stage, t in zip(stages, (t1 - t0, t2 - t1, t3 - t2)):
+			times[stage].append(t)
+		if out:
+			record = {'frame': n, 'faces': faces}
+			if isinstance(source, ImageSequence):
+				record['image'] = source.name()
+			out.write(json.dumps(record)+'\n')
+		n += 1
+
+		if show:
+			for (x, y, w, h) in faces:
+				cv2.rectangle(frame, (x, y), (x+w, y+h), (0, 255, 0), 2)
+			cv2.imshow('Video', frame)
+			if cv2.waitKey(1) & 0xFF == ord('q'):
+				break
+		elif n % 50 == 0:
+			sys.stdout.write('\r{:d} frames, {:.1f} fps'.format(n, n / (time.time() - start)))
+			sys.stdout.flush()
+
+	elapsed = time.time() - start
+	sys.stdout.write('\r')
+	if not n:
+		print 'No frames read'
+		return
+	print '{:d} frames in {:.2f}s, {:.1f} fps'.format(n, elapsed, n / elapsed)
+	for stage in stages:
+		ms = np.array(times[stage]) * 1000
+		print '  {:<7s} mean {:7.2f} ms, p50 {:7.2f} ms, p95 {:7.2f} ms'.format(
+			stage, ms.mean(), np.percentile(ms, 50), np.percentile(ms, 95))
+
+def open_source(source):
+	"""
+	open_source(Source) -> something with read() and release() like cv2.VideoCapture
+	Source is a camera number, a video file or a directory of images.
+	"""
+	if source.isdigit():
+		return cv2.VideoCapture(int(source))
+	if os.path.isdir(source):
+		return ImageSequence(source)
+	video_capture = cv2.VideoCapture(source)
+	if not video_capture.isOpened():
+		sys.exit("Couldn't open "+source)
+	return video_capture
 
-	# Draw a rectangle around the faces
-	for (x, y, w, h) in faces:
-		cv2.rectangle(frame, (x, y), (x+w, y+h), (0, 255, 0), 2)
+def parse_args():
+	"""Parse input arguments."""
+	parser = argparse.ArgumentParser(description='Detect faces in webcam video, a video file or images')
+	parser.add_argument('cascade', help='Haar cascade XML file')
+	parser.add_argument('--source', default='0',
+						help='Camera number, video file, or directory of images [0]')
+	parser.add_argument('--headless', action='store_true', help="Don't show the video")
+	parser.add_argument('--output', help='File to write each frame\'s detections to, as JSON lines')
+	parser.add_argument('--track', default=0, type=int, metavar='N',
+						help='Only search the whole frame every N frames, tracking faces in between')
+	parser.add_argument('--margin', default=0.5, type=float,
+						help='How far around a tracked face to search, as a fraction of its size [0.5]')
+	return parser.parse_args()
 
-	# Display the resulting frame
-	cv2.imshow('Video', frame)
+if __name__ == '__main__':
+	args = parse_args()
+	faceCascade = cv2.CascadeClassifier(args.cascade)
+	if args.track:
+		tracker = FaceTracker(faceCascade, args.track, args.margin)
+		find_faces = tracker.update
+	else:
+		tracker = None
+		find_faces = lambda gray: detect_faces(faceCascade, gray)
 
-	if cv2.waitKey(1) & 0xFF == ord('q'):
-		break
+	out = open(args.output, 'w') if args.output else None
+	video_capture = open_source(args.source)
+	if args.source.isdigit():
+		run_live(video_capture, find_faces, out, not args.headless)
+	else:
+		# every frame of recorded footage gets detected, so runs are repeatable
+		run_offline(video_capture, find_faces, out, not args.headless)
+	if tracker and tracker.frames:
+		print 'Searched the whole frame for {:d} of {:d} frames'.format(tracker.full, tracker.frames)
+	if out:
+		out.close()
 
-# When everything is done, release the capture
-video_capture.release()
-cv2.destroyAllWindows()
+	# When everything is done, release the capture
+	video_capture.release()
+	if not args.headless:
+		cv2.destroyAllWindows()